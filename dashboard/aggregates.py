@@ -0,0 +1,196 @@
+# aggregates.py
+# Agrégats affichés par le dashboard, avec deux implémentations de même interface :
+#   - FrameAggregates : groupbys pandas sur les lignes chargées (mode détail)
+#   - RpcAggregates   : fonctions SQL côté base (sql/matrix_aggregates.sql), appelées en RPC ;
+#                       le volume transféré dépend de ce qui est affiché, pas de la taille de la table.
+from datetime import date
+from typing import Callable, Optional, Sequence
+
+import pandas as pd
+
+GRANULARITIES = {"Jour": "day", "Semaine": "week", "Mois": "month"}
+MEASURES = ["qte", "ventes_ht", "ventes_ttc", "marge_ht"]
+
+
+def bucket_start(dates: pd.Series, granularity: str) -> pd.Series:
+    if granularity == "Jour":
+        return dates.dt.normalize()
+    if granularity == "Semaine":
+        return dates.dt.normalize() - pd.to_timedelta(dates.dt.weekday, unit="D")
+    return dates.dt.to_period("M").dt.to_timestamp()
+
+
+def bucket_labels(bucket: pd.Series, granularity: str) -> pd.Series:
+    if granularity == "Jour":
+        return bucket.dt.strftime("%Y-%m-%d")
+    if granularity == "Semaine":
+        end = bucket + pd.to_timedelta(6, unit="D")
+        return "du " + bucket.dt.strftime("%d/%m/%Y") + " au " + end.dt.strftime("%d/%m/%Y")
+    return bucket.dt.strftime("%b %Y")
+
+
+def iso_shift_years(d: date, years: int) -> date:
+    """Même semaine ISO et même jour de semaine, `years` années ISO plus tôt/tard (S53 -> S52 si absente)."""
+    y, w, wd = d.isocalendar()
+    last_week = date(y + years, 12, 28).isocalendar()[1]
+    return date.fromisocalendar(y + years, min(w, last_week), wd)
+
+
+def align_prior_buckets(bucket: pd.Series, granularity: str) -> pd.Series:
+    """Replace des périodes N-1 sur l'axe de N : semaine ISO + 1 an (Jour/Semaine, N-1 lu sur la
+    fenêtre ISO), mois + 1 an (Mois, N-1 lu sur les mêmes dates calendaires un an plus tôt)."""
+    if granularity == "Mois":
+        return bucket + pd.DateOffset(years=1)
+    return pd.to_datetime(bucket.dt.date.map(lambda d: iso_shift_years(d, 1)))
+
+
+def store_leaderboard(sw: pd.DataFrame, last_week: tuple, prev_week: tuple) -> pd.DataFrame:
+    """Classement des magasins depuis la matrice magasin × semaine ISO (store_weeks) : totaux,
+    marge %, prix moyen d'article et évolution du CA TTC de `prev_week` à `last_week` ((année, semaine))."""
+    key = sw["iso_year"] * 100 + sw["iso_week"]
+    tot = sw.groupby("store_name")[MEASURES].sum()
+    ca_last = sw[key == last_week[0] * 100 + last_week[1]].groupby("store_name")["ventes_ttc"].sum()
+    ca_prev = sw[key == prev_week[0] * 100 + prev_week[1]].groupby("store_name")["ventes_ttc"].sum()
+    out = pd.DataFrame({
+        "ca_ttc": tot["ventes_ttc"],
+        "marge_pct": (tot["marge_ht"] / tot["ventes_ht"].where(tot["ventes_ht"] != 0)) * 100,
+        "prix_moyen": tot["ventes_ttc"] / tot["qte"].where(tot["qte"] != 0),
+        "ca_sem": ca_last.reindex(tot.index).fillna(0),
+        "ca_sem_prec": ca_prev.reindex(tot.index).fillna(0),
+    })
+    out["evol_pct"] = (out["ca_sem"] - out["ca_sem_prec"]) / out["ca_sem_prec"].where(out["ca_sem_prec"] != 0) * 100
+    out = out.sort_values("ca_ttc", ascending=False).reset_index()
+    out.insert(0, "rang", range(1, len(out) + 1))
+    return out
+
+
+def _numeric(df: pd.DataFrame, cols: Sequence[str]) -> pd.DataFrame:
+    for c in cols:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
+    return df
+
+
+class FrameAggregates:
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+
+    def _scope(self, stores: Optional[Sequence[str]]) -> pd.DataFrame:
+        return self.df if not stores else self.df[self.df["store_name"].isin(stores)]
+
+    def kpis(self, stores: Optional[Sequence[str]] = None) -> dict:
+        d = self._scope(stores)
+        out = {c: float(d[c].sum()) for c in MEASURES}
+        out["n_lignes"] = len(d)
+        return out
+
+    def series(self, granularity: str, stores: Optional[Sequence[str]] = None, by_store: bool = True) -> pd.DataFrame:
+        d = self._scope(stores)
+        group_cols = ["store_name", "bucket"] if by_store else ["bucket"]
+        return (d.assign(bucket=bucket_start(d["period_date"], granularity))
+                 .groupby(group_cols, as_index=False)
+                 .agg(ca_ttc=("ventes_ttc", "sum"),
+                      ca_ht=("ventes_ht", "sum"),
+                      marge=("marge_ht", "sum"),
+                      qte=("qte", "sum")))
+
+    def familles(self, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return (self._scope(stores).groupby("famille_finale", as_index=False, observed=True)
+                .agg(ca_ttc=("ventes_ttc", "sum"))
+                .astype({"famille_finale": object}))
+
+    def top_articles(self, limit: int, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return (self._scope(stores).groupby(["code_article", "libelle_final"], as_index=False, observed=True)
+                .agg(qte=("qte", "sum"), ca_ttc=("ventes_ttc", "sum"))
+                .astype({"libelle_final": object})
+                .sort_values("ca_ttc", ascending=False)
+                .head(limit))
+
+    def daily(self, stores: Optional[Sequence[str]] = None, by_store: bool = False) -> pd.DataFrame:
+        """Totaux par jour (et par magasin) : mêmes colonnes que les lignes, réagrégeables ici."""
+        d = self._scope(stores)
+        keys = ["store_name", "period_date"] if by_store else ["period_date"]
+        out = d.groupby(keys, as_index=False)[MEASURES].sum()
+        if not by_store:
+            out.insert(0, "store_name", "")
+        return out
+
+    def store_weeks(self, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Totaux par magasin × semaine ISO : base du classement réseau."""
+        d = self._scope(stores)
+        iso = d["period_date"].dt.isocalendar()
+        return (d.assign(iso_year=iso.year.astype(int), iso_week=iso.week.astype(int))
+                 .groupby(["store_name", "iso_year", "iso_week"], as_index=False)[MEASURES].sum())
+
+    def dow_week(self, stores: Optional[Sequence[str]] = None, by_store: bool = False) -> pd.DataFrame:
+        d = self._scope(stores)
+        iso = d["period_date"].dt.isocalendar()
+        keys = (["store_name"] if by_store else []) + ["iso_year", "iso_week", "isodow"]
+        return (d.assign(iso_year=iso.year.astype(int), iso_week=iso.week.astype(int), isodow=iso.day.astype(int))
+                 .groupby(keys, as_index=False)[["qte", "ventes_ttc"]].sum())
+
+
+class RpcAggregates:
+    """Mêmes agrégats, calculés par la base. `call(fonction, paramètres)` renvoie une liste de dicts."""
+
+    def __init__(self, call: Callable[[str, dict], list], dstart: date, dend: date):
+        self.call = call
+        self.dstart = dstart
+        self.dend = dend
+
+    def _rpc(self, fn: str, stores: Optional[Sequence[str]], **extra) -> pd.DataFrame:
+        params = {"p_start": self.dstart.isoformat(), "p_end": self.dend.isoformat(),
+                  "p_stores": list(stores) if stores else None}
+        params.update(extra)
+        return pd.DataFrame(self.call(fn, params) or [])
+
+    def kpis(self, stores: Optional[Sequence[str]] = None) -> dict:
+        d = _numeric(self._rpc("matrix_kpis", stores), MEASURES + ["n_lignes"])
+        out = {c: float(d[c].iloc[0]) if not d.empty else 0.0 for c in MEASURES}
+        out["n_lignes"] = int(d["n_lignes"].iloc[0]) if not d.empty else 0
+        return out
+
+    def series(self, granularity: str, stores: Optional[Sequence[str]] = None, by_store: bool = True) -> pd.DataFrame:
+        d = self._rpc("matrix_series", stores, p_granularity=GRANULARITIES[granularity], p_by_store=by_store)
+        cols = (["store_name"] if by_store else []) + ["bucket", "ca_ttc", "ca_ht", "marge", "qte"]
+        if d.empty:
+            return pd.DataFrame(columns=cols)
+        d["bucket"] = pd.to_datetime(d["bucket"])
+        return _numeric(d, ["ca_ttc", "ca_ht", "marge", "qte"])[cols]
+
+    def familles(self, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        d = self._rpc("matrix_familles", stores)
+        if d.empty:
+            return pd.DataFrame(columns=["famille_finale", "ca_ttc"])
+        return _numeric(d, ["ca_ttc"])
+
+    def top_articles(self, limit: int, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        d = self._rpc("matrix_top_articles", stores, p_limit=int(limit))
+        if d.empty:
+            return pd.DataFrame(columns=["code_article", "libelle_final", "qte", "ca_ttc"])
+        return _numeric(d, ["qte", "ca_ttc"])
+
+    def daily(self, stores: Optional[Sequence[str]] = None, by_store: bool = False) -> pd.DataFrame:
+        d = self._rpc("matrix_daily", stores, p_by_store=by_store)
+        if d.empty:
+            return pd.DataFrame(columns=["store_name", "period_date"] + MEASURES)
+        d["period_date"] = pd.to_datetime(d["period_date"])
+        d["store_name"] = d["store_name"].fillna("")
+        return _numeric(d, MEASURES)[["store_name", "period_date"] + MEASURES]
+
+    def store_weeks(self, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        d = self._rpc("matrix_store_weeks", stores)
+        cols = ["store_name", "iso_year", "iso_week"] + MEASURES
+        if d.empty:
+            return pd.DataFrame(columns=cols)
+        d[["iso_year", "iso_week"]] = d[["iso_year", "iso_week"]].astype(int)
+        return _numeric(d, MEASURES)[cols]
+
+    def dow_week(self, stores: Optional[Sequence[str]] = None, by_store: bool = False) -> pd.DataFrame:
+        d = self._rpc("matrix_dow_week", stores, p_by_store=by_store)
+        cols = (["store_name"] if by_store else []) + ["iso_year", "iso_week", "isodow", "qte", "ventes_ttc"]
+        if d.empty:
+            return pd.DataFrame(columns=cols)
+        for c in ["iso_year", "iso_week", "isodow"]:
+            d[c] = d[c].astype(int)
+        return _numeric(d, ["qte", "ventes_ttc"])[cols]
@@ -1,15 +1,39 @@
 import os
+import json
+import time
+import uuid
 import pandas as pd
 import altair as alt
 import streamlit as st
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from datetime import date
+from datetime import date, timedelta
+
+from aggregates import (GRANULARITIES, FrameAggregates, RpcAggregates, align_prior_buckets, bucket_labels,
+                        iso_shift_years, store_leaderboard)
+from baselines import BASELINE_WEEKS, DowIndex
+from charts import (AUTRES, TOP_K_FAMILIES, TOP_K_STORES, downsample_series, format_bytes,
+                    payload_bytes, top_k_with_other)
+from exports import EXPORT_FORMATS, available_formats, export_to_file, read_export, sweep_exports
+from perf import cached_call, current_run, mark_miss, new_run
+from planner import EXPORT_BUDGET_MB, SESSION_BUDGET_MB, BudgetExceeded, RowBytes, plan_load
+from sharedcache import cache_key, from_env as shared_cache_from_env
+from singleflight import flight
+from warmup import WarmupWorker
+from wire import article_frame, csv_has_rows, decode_csv_pages, join_articles, typed_frame
+from snapshot import DuckAggregates, available as duckdb_available, months_between, stale_months, sync_range
 
 # ---------- Config ----------
 load_dotenv()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.environ.get("SUPABASE_ANON_KEY")
+# Moteur des agrégats sans détail : "rpc" (fonctions SQL Supabase) ou "duckdb" (snapshot Parquet local)
+MATRIX_ENGINE = os.environ.get("MATRIX_ENGINE", "rpc").lower()
+USE_DUCKDB = MATRIX_ENGINE == "duckdb" and duckdb_available()
+# Format des pages v_matrix : "csv" (décodage en colonnes typées) ou "json" (dicts par ligne)
+WIRE_FORMAT = os.environ.get("MATRIX_WIRE_FORMAT", "csv").lower()
+# Libellés/familles chargés à part (dimension article) : les lignes ne transportent que les codes
+ARTICLE_DIM = os.environ.get("MATRIX_ARTICLE_DIM", "true").lower() == "true"
 
 if not SUPABASE_URL or not SUPABASE_ANON_KEY:
     st.error("⚠️ SUPABASE_URL et SUPABASE_ANON_KEY doivent être définis dans .env")
@@ -58,6 +82,381 @@ button[kind="secondary"]:focus {
 </style>
 """, unsafe_allow_html=True)
 
+# ---------- Octets reçus : comptés sur la réponse HTTP, sans resérialiser les données ----------
+def count_http_bytes(response):
+    response.read()  # corps lu une fois ici, le client PostgREST réutilise le même contenu
+    kind = "rpc" if "/rpc/" in response.request.url.path else "fetch"
+    current_run().count(f"{kind}.bytes", len(response.content))
+
+def watch_http_bytes():
+    # le client PostgREST est recréé à chaque événement d'auth : le hook est reposé si besoin
+    session = getattr(getattr(supabase, "postgrest", None), "session", None)
+    if session is not None and count_http_bytes not in session.event_hooks["response"]:
+        hooks = session.event_hooks
+        session.event_hooks = {**hooks, "response": hooks["response"] + [count_http_bytes]}
+
+# ---------- Pagination (avec comptage lignes / pages) ----------
+def iter_pages(table, batch_size: int = 1000):
+    run = current_run()
+    offset = 0
+    while True:
+        res = table.range(offset, offset + batch_size - 1).execute()
+        run.count("fetch.pages")
+        if not res.data:
+            break
+        run.count("fetch.rows", len(res.data))
+        yield res.data
+        offset += batch_size
+
+def iter_csv_pages(table, batch_size: int = 1000):
+    # même pagination, réponse en text/csv : pas de dict Python par ligne
+    run = current_run()
+    offset = 0
+    while True:
+        res = table.range(offset, offset + batch_size - 1).csv().execute()
+        run.count("fetch.pages")
+        text = res.data if isinstance(res.data, str) else ""
+        if not csv_has_rows(text):
+            break
+        run.count("fetch.rows", text.rstrip("\n").count("\n"))
+        yield text
+        offset += batch_size
+
+# ---------- Single-flight : un seul travail réel par clé, partagé entre sessions ----------
+# Hors st.cache_data uniquement (voir singleflight.py) : les fonctions en cache ont déjà leur verrou par clé.
+def single_flight(name: str, key: tuple, fn, *args, **kwargs):
+    result, shared = flight.do((name,) + key, fn, *args, **kwargs)
+    if shared:
+        current_run().count(f"singleflight.shared.{name}")
+    return result
+
+# ---------- Cache partagé entre réplicas (optionnel, voir sharedcache.py) ----------
+# Consulté après un miss st.cache_data, avant le chargement réel ; les clés incluent le jeton de
+# version, donc une entrée partagée n'est jamais périmée, elle cesse simplement d'être demandée.
+@st.cache_resource
+def shared_cache():
+    return shared_cache_from_env()
+
+def shared_tier(name: str, key: tuple, kind: str, fn, *args):
+    store = shared_cache()
+    if store is None:
+        return fn(*args)
+    run = current_run()
+    k = cache_key(name, *key)
+    try:
+        hit = store.get_frame(k) if kind == "frame" else store.get_json(k)
+    except Exception:
+        hit = None  # support injoignable : on charge normalement
+    if hit is not None:
+        run.count(f"shared.hit.{name}")
+        return hit
+    run.count(f"shared.miss.{name}")
+    value = fn(*args)
+    try:
+        if kind == "frame":
+            store.put_frame(k, value)
+        else:
+            store.put_json(k, value)
+    except Exception:
+        run.count(f"shared.put_error.{name}")
+    return value
+
+# ---------- Versions des données (écrites par l'uploader, voir sql/matrix_versions.sql) ----------
+# Les caches ci-dessous sont indexés sur la version des partitions (magasin × mois) de la période :
+# l'historique inchangé reste en cache, un import est visible dès la prochaine vérification.
+VERSION_POLL_S = 15   # fréquence de vérification de la dernière mise à jour
+LEGACY_TTL = 300      # repli si la table des versions n'existe pas : ancien comportement ttl=300
+VERSION_TTL = 24 * 3600  # filet de sécurité : une version jamais incrémentée ne sert pas indéfiniment
+
+@st.cache_data(ttl=VERSION_POLL_S, show_spinner=False)
+def data_head():
+    try:
+        r = supabase.table("matrix_partitions").select("updated_at").order("updated_at", desc=True).limit(1).execute()
+    except Exception:
+        return None
+    return r.data[0]["updated_at"] if r.data else ""
+
+@st.cache_data(ttl=VERSION_TTL, max_entries=4, show_spinner=False)
+def load_versions(head: str) -> pd.DataFrame:
+    def fetch(columns: str) -> list:
+        table = (
+            supabase.table("matrix_partitions")
+            .select(columns)
+            .order("store_name", desc=False)
+            .order("month", desc=False)
+        )
+        rows = []
+        for page in iter_pages(table):
+            rows.extend(page)
+        return rows
+
+    try:
+        rows = fetch("store_name,month,version,row_count")
+    except Exception:
+        rows = fetch("store_name,month,version")  # table créée avant la colonne row_count
+    v = pd.DataFrame(rows, columns=["store_name", "month", "version", "row_count"])
+    v["month"] = v["month"].astype(str).str[:7]
+    v["version"] = pd.to_numeric(v["version"], errors="coerce").fillna(0).astype(int)
+    v["row_count"] = pd.to_numeric(v["row_count"], errors="coerce")
+    return v
+
+def month_rows():
+    """{mois: lignes} d'après les statistiques de partitions (NaN : un magasin du mois sans compte),
+    ou None si la table des versions manque."""
+    head = data_head()
+    if head is None:
+        return None
+    v = load_versions(head)
+    if v.empty:
+        return None
+    rows = v.groupby("month")["row_count"].sum()
+    rows[v["row_count"].isna().groupby(v["month"]).any()] = float("nan")
+    return rows
+
+def month_versions(dstart: date, dend: date):
+    """{mois: jeton} pour la période, ou None si le signal de version n'est pas disponible."""
+    head = data_head()
+    if head is None:
+        return None
+    months = months_between(dstart, dend)
+    v = load_versions(head)
+    v = v[v["month"].isin(months)].groupby("month")["version"].agg(["count", "sum"])
+    return {m: (f"{int(v.loc[m, 'count'])}:{int(v.loc[m, 'sum'])}" if m in v.index else "0:0") for m in months}
+
+def data_version(dstart: date = None, dend: date = None) -> str:
+    """Jeton de cache : change uniquement si une partition de la période (ou de la table) change."""
+    head = data_head()
+    if head is None:
+        return f"ttl:{int(time.time() // LEGACY_TTL)}"
+    if dstart is None:
+        return head
+    return "|".join(f"{m}={t}" for m, t in month_versions(dstart, dend).items())
+
+# ---------- Chargement des filtres de base ----------
+def _fetch_filters():
+    r1 = supabase.table("v_matrix").select("period_date").order("period_date", desc=False).limit(1).execute()
+    r2 = supabase.table("v_matrix").select("period_date").order("period_date", desc=True).limit(1).execute()
+
+    table = (
+        supabase.table("v_matrix")
+        .select("store_name")
+        .neq("store_name", "")
+        .order("store_name", desc=False)
+    )
+    all_stores = []
+    for page in iter_pages(table):
+        all_stores.extend(page)
+
+    if not r1.data or not r2.data:
+        return None, None, []
+
+    dmin = pd.to_datetime(r1.data[0]["period_date"]).date()
+    dmax = pd.to_datetime(r2.data[0]["period_date"]).date()
+    stores = sorted({row["store_name"] for row in all_stores if row.get("store_name")})
+    return dmin, dmax, stores
+
+@st.cache_data(ttl=VERSION_TTL, max_entries=8)
+def load_filters(version: str):
+    mark_miss("load_filters")
+    return _fetch_filters()
+
+# ---------- Dimension article (code -> libellé, famille) ----------
+@st.cache_data(ttl=VERSION_TTL, max_entries=4, show_spinner=False)
+def load_articles(version: str):
+    # pas de try ici : un échec lève, rien n'est mis en cache et l'appel suivant réessaie
+    mark_miss("load_articles")
+    rows = shared_tier("articles", (version,), "json", _fetch_rpc, "matrix_articles", {})
+    current_run().count("articles.rows", len(rows))
+    return article_frame(rows)
+
+def article_dim():
+    """Dimension article, ou None si elle est indisponible (fonction absente, erreur réseau) :
+    les lignes sont alors lues avec leurs libellés."""
+    if not ARTICLE_DIM:
+        return None
+    try:
+        return load_articles(data_version())
+    except Exception:
+        current_run().count("articles.errors")
+        return None
+
+# ---------- Chargement des données ----------
+MATRIX_COLUMNS = "store_name,period_date,code_article,libelle_final,famille_finale,qte,ventes_ht,ventes_ttc,marge_ht,marge_pct"
+FACT_COLUMNS = "store_name,period_date,code_article,qte,ventes_ht,ventes_ttc,marge_ht,marge_pct"
+
+def matrix_query(dstart: date, dend: date, columns: str = MATRIX_COLUMNS):
+    return (
+        supabase.table("v_matrix")
+        .select(columns)
+        .gte("period_date", dstart.isoformat())
+        .lte("period_date", dend.isoformat())
+        .order("period_date", desc=False)
+        .order("store_name", desc=False)
+        .order("code_article", desc=False)
+    )
+
+DECODE_ROWS = 50_000  # lignes décodées à la fois : granularité du contrôle de budget
+
+def _iter_blocks(query, block_rows: int):
+    """Blocs typés d'environ block_rows lignes, tels que reçus (sans jointure article)."""
+    if WIRE_FORMAT == "csv" and hasattr(query, "csv"):
+        pages, n = [], 0
+        for text in iter_csv_pages(query):
+            pages.append(text)
+            n += text.rstrip("\n").count("\n")
+            if n >= block_rows:
+                yield decode_csv_pages(pages)
+                pages, n = [], 0
+        if pages:
+            yield decode_csv_pages(pages)
+        return
+    buf = []
+    for page in iter_pages(query):
+        buf.extend(page)
+        if len(buf) >= block_rows:
+            yield typed_frame(buf)
+            buf = []
+    if buf:
+        yield typed_frame(buf)
+
+def iter_data_chunks(dstart: date, dend: date, chunk_rows: int = 50_000, categorical: bool = False,
+                     max_bytes: int = None):
+    """Parcourt la période par morceaux typés (chunk_rows=None : un seul morceau, assemblé à la fin).
+    Avec la dimension article, libellés et familles sont joints localement (catégories si demandé).
+    max_bytes : BudgetExceeded dès que les lignes décodées dépassent la borne, sans lire la suite."""
+    dim = article_dim()
+    query = matrix_query(dstart, dend, FACT_COLUMNS if dim is not None else MATRIX_COLUMNS)
+
+    def finish(frame: pd.DataFrame) -> pd.DataFrame:
+        return join_articles(frame, dim, categorical) if dim is not None and not frame.empty else frame
+
+    used, blocks = 0, []
+    for block in _iter_blocks(query, chunk_rows or DECODE_ROWS):
+        if max_bytes is not None:
+            used += int(block.memory_usage(deep=True).sum())
+            if used > max_bytes:
+                raise BudgetExceeded(used, max_bytes)
+        if chunk_rows:
+            yield finish(block)
+        else:
+            blocks.append(block)
+    if blocks:
+        yield finish(blocks[0] if len(blocks) == 1 else pd.concat(blocks, ignore_index=True))
+
+def _fetch_data(dstart: date, dend: date) -> pd.DataFrame:
+    # en mémoire : libellés en catégories (une copie par libellé distinct) ; au-delà du budget de
+    # session, le parcours s'arrête et rien n'est mis en cache
+    frames = list(iter_data_chunks(dstart, dend, chunk_rows=None, categorical=True,
+                                   max_bytes=int(SESSION_BUDGET_MB * 1024 ** 2)))
+    return frames[0] if frames else typed_frame([])
+
+@st.cache_data(ttl=VERSION_TTL, max_entries=16)
+def load_data(dstart: date, dend: date, version: str) -> pd.DataFrame:
+    mark_miss("load_data")
+    key = (dstart, dend, version)
+    return shared_tier("load_data", key, "frame", _fetch_data, dstart, dend)
+
+# ---------- Agrégats côté base (RPC, voir sql/matrix_aggregates.sql) ----------
+# Les fonctions à gros résultat renvoient un tableau JSON unique : un appel = une exécution,
+# sans troncature max-rows.
+def _fetch_rpc(fn: str, params: dict) -> list:
+    run = current_run()
+    res = supabase.rpc(fn, params).execute()
+    rows = res.data or []
+    run.count("rpc.calls")
+    run.count("rpc.rows", len(rows))
+    return rows
+
+@st.cache_data(ttl=VERSION_TTL, max_entries=512, show_spinner=False)
+def rpc_aggregate(fn: str, params: dict, version: str) -> list:
+    mark_miss("rpc_aggregate")
+    key = (fn, json.dumps(params, sort_keys=True), version)
+    return shared_tier("rpc", key, "json", _fetch_rpc, fn, params)
+
+def rpc_call(fn: str, params: dict) -> list:
+    version = data_version(date.fromisoformat(params["p_start"]), date.fromisoformat(params["p_end"]))
+    return cached_call("rpc_aggregate", rpc_aggregate, fn, params, version)
+
+# ---------- Snapshot DuckDB ----------
+def _sync_month(month: str, versions):
+    # staleness revérifiée sous le single-flight : un mois écrit entre-temps par une autre session est sauté
+    p = pd.Period(month, freq="M")
+    return sync_range(p.start_time.date(), p.end_time.date(), iter_data_chunks,
+                      versions=None if versions is None else {month: versions.get(month)})
+
+def sync_snapshot(dstart: date, dend: date) -> list:
+    # seuls les mois dont la version a changé (ou absents) sont resynchronisés, un single-flight par
+    # mois : deux périodes qui se recouvrent (préchauffage, sessions) ne téléchargent un mois qu'une fois
+    versions = month_versions(dstart, dend)
+    synced = []
+    for m in stale_months(dstart, dend, versions=versions):
+        synced += single_flight("snapshot_sync", (m, None if versions is None else versions.get(m)),
+                                _sync_month, m, versions)
+    return synced
+
+# ---------- Index jour de semaine (graphiques hebdo, moyennes glissantes) ----------
+@st.cache_resource(ttl=VERSION_TTL, max_entries=8, show_spinner=False)
+def dow_index(dlo: date, dhi: date, version: str) -> DowIndex:
+    mark_miss("dow_index")
+    if USE_DUCKDB:
+        sync_snapshot(dlo, dhi)
+        return DowIndex(DuckAggregates(dlo, dhi).dow_week(by_store=True))
+    # mois par mois : chaque mois garde son entrée (et son jeton de version) dans le cache RPC,
+    # un import ou une période voisine ne refait que les mois concernés
+    frames = []
+    for m in months_between(dlo, dhi):
+        p = pd.Period(m, freq="M")
+        a, b = max(dlo, p.start_time.date()), min(dhi, p.end_time.date())
+        frames.append(RpcAggregates(rpc_call, a, b).dow_week(by_store=True))
+    return DowIndex(pd.concat(frames, ignore_index=True))
+
+def dow_index_range(dstart: date, dend: date, dmin: date) -> tuple:
+    # période + historique des moyennes glissantes, à partir d'un lundi
+    dlo = dstart - timedelta(weeks=max(BASELINE_WEEKS))
+    return max(dmin, dlo - timedelta(days=dlo.weekday())), dend
+
+# ---------- Préchauffage des caches (thread de fond, un par processus) ----------
+TOP_DEFAULT = 15
+WARMUP_ENABLED = os.environ.get("MATRIX_WARMUP", "true").lower() == "true"
+
+def warm_range(dstart: date, dend: date):
+    # mêmes appels que l'affichage par défaut (tous magasins, top 15, toutes granularités)
+    if USE_DUCKDB:
+        sync_snapshot(dstart, dend)
+        return
+    agg = RpcAggregates(rpc_call, dstart, dend)
+    agg.kpis()
+    for g in GRANULARITIES:
+        agg.series(g, by_store=False)
+    agg.familles()
+    agg.top_articles(TOP_DEFAULT)
+    agg.dow_week()
+    agg.store_weeks()
+    dmin_w = load_filters(data_version())[0]
+    dlo, dhi = dow_index_range(dstart, dend, dmin_w)
+    dow_index(dlo, dhi, data_version(dlo, dhi))
+
+def warmup_tasks() -> list:
+    dmin_w, dmax_w, _ = load_filters(data_version())
+    if dmin_w is None:
+        return []
+    ranges = {
+        "Période complète": (dmin_w, dmax_w),
+        "4 dernières semaines": (max(dmin_w, dmax_w - timedelta(days=27)), dmax_w),
+        "Mois en cours": (max(dmin_w, dmax_w.replace(day=1)), dmax_w),
+    }
+    return [(name, data_version(a, b), lambda a=a, b=b: warm_range(a, b)) for name, (a, b) in ranges.items()]
+
+@st.cache_resource
+def start_warmup():
+    worker = WarmupWorker(warmup_tasks,
+                          poll_s=float(os.environ.get("MATRIX_WARMUP_POLL", "30")),
+                          refresh_s=float(os.environ.get("MATRIX_WARMUP_REFRESH", "3600")))
+    worker.start()
+    return worker
+
+warmup = start_warmup() if WARMUP_ENABLED else None
+
 # ---------- Utilisateurs autorisés ----------
 ALLOWED = {
     "o.ginoux@emova-group.com",
@@ -97,6 +496,8 @@ if st.session_state["auth"]["user"] is None:
 
 user = st.session_state["auth"]["user"]
 st.sidebar.success(f"✅ Connecté : {user.email}")
+if warmup is not None:
+    st.sidebar.caption("🔥 Cache préchauffé" if warmup.is_warm() else "⏳ Préchauffage du cache en cours…")
 if st.sidebar.button("Se déconnecter"):
     st.session_state["auth"] = {"user": None, "session": None, "error": None}
     st.rerun()
@@ -117,6 +518,20 @@ USER_NAMES = {
 email = user.email.lower()
 display_name = USER_NAMES.get(email, email)
 
+# ---------- Instrumentation (une mesure par exécution du script) ----------
+ADMIN_EMAILS = {"dsi@emova-group.com"}
+if "perf_session" not in st.session_state:
+    st.session_state["perf_session"] = uuid.uuid4().hex[:12]
+perf = new_run(session_id=st.session_state["perf_session"], user=email)
+watch_http_bytes()
+# mesures coûteuses (taille des graphiques sérialisés) : seulement sur demande d'un admin
+perf_detail = email in ADMIN_EMAILS and st.sidebar.toggle("⏱️ Mesures détaillées (admin)", key="perf_detail")
+
+def stop_run():
+    """st.stop() en journalisant tout de même la mesure de l'exécution."""
+    perf.emit()
+    st.stop()
+
 st.markdown(
     f"<h2 style='color:#1a73e8;'>👋 Bienvenue {display_name} !</h2>",
     unsafe_allow_html=True
@@ -125,72 +540,10 @@ st.markdown(
 # ---------- Dashboard ----------
 st.title("📊 Matrix — Ventes & Marge")
 
-# ---------- Chargement des filtres de base ----------
-@st.cache_data(ttl=300)
-def load_filters():
-    r1 = supabase.table("v_matrix").select("period_date").order("period_date", desc=False).limit(1).execute()
-    r2 = supabase.table("v_matrix").select("period_date").order("period_date", desc=True).limit(1).execute()
-
-    table = (
-        supabase.table("v_matrix")
-        .select("store_name")
-        .neq("store_name", "")
-        .order("store_name", desc=False)
-    )
-    batch_size = 1000
-    offset = 0
-    all_stores = []
-    while True:
-        res = table.range(offset, offset + batch_size - 1).execute()
-        if not res.data:
-            break
-        all_stores.extend(res.data)
-        offset += batch_size
-
-    if not r1.data or not r2.data:
-        return None, None, []
-
-    dmin = pd.to_datetime(r1.data[0]["period_date"]).date()
-    dmax = pd.to_datetime(r2.data[0]["period_date"]).date()
-    stores = sorted({row["store_name"] for row in all_stores if row.get("store_name")})
-    return dmin, dmax, stores
-
-dmin, dmax, stores = load_filters()
+dmin, dmax, stores = cached_call("load_filters", load_filters, data_version())
 if dmin is None:
     st.warning("Aucune donnée dans v_matrix.")
-    st.stop()
-
-# ---------- Chargement des données ----------
-@st.cache_data(ttl=300)
-def load_data(dstart: date, dend: date) -> pd.DataFrame:
-    table = (
-        supabase.table("v_matrix")
-        .select("store_name,period_date,code_article,libelle_final,famille_finale,qte,ventes_ht,ventes_ttc,marge_ht,marge_pct")
-        .gte("period_date", dstart.isoformat())
-        .lte("period_date", dend.isoformat())
-        .order("period_date", desc=False)
-        .order("store_name", desc=False)
-        .order("code_article", desc=False)
-    )
-
-    batch_size = 1000
-    offset = 0
-    all_data = []
-    while True:
-        res = table.range(offset, offset + batch_size - 1).execute()
-        if not res.data:
-            break
-        all_data.extend(res.data)
-        offset += batch_size
-
-    df = pd.DataFrame(all_data or [])
-    if not df.empty:
-        df["period_date"] = pd.to_datetime(df["period_date"])
-        num_cols = ["qte","ventes_ht","ventes_ttc","marge_ht","marge_pct"]
-        for c in num_cols:
-            if c in df.columns:
-                df[c] = pd.to_numeric(df[c], errors="coerce")
-    return df
+    stop_run()
 
 # ---------- UI Filtres ----------
 col_filters = st.columns([2, 2, 3])
@@ -202,38 +555,148 @@ if isinstance(drange, tuple) and len(drange) == 2:
 elif hasattr(drange, "year"):
     dstart, dend = drange, drange
 else:
-    st.stop()
+    stop_run()
 
 with col_filters[1]:
     st.markdown("<p style='font-size:18px; font-weight:600; margin-bottom:-8px;'>⏱️ Granularité</p>", unsafe_allow_html=True)
-    granularity = st.radio("", ["Jour", "Semaine", "Mois"], horizontal=True, label_visibility="collapsed")
+    granularity = st.radio("", ["Jour", "Semaine", "Mois"], horizontal=True, label_visibility="collapsed", key="granularity")
 with col_filters[2]:
     st.markdown("<p style='font-size:18px; font-weight:600; margin-bottom:-8px;'>🏬 Magasins à comparer</p>", unsafe_allow_html=True)
     store_options = ["Tous les magasins"] + stores
-    selected_stores = st.multiselect("", store_options, default=["Tous les magasins"], label_visibility="collapsed")
+    selected_stores = st.multiselect("", store_options, default=["Tous les magasins"], label_visibility="collapsed", key="stores_pick")
 
-if st.button("⚡ Charger / Actualiser les données", type="primary"):
+detail_mode = st.toggle(
+    "📋 Charger aussi le détail des lignes", value=False, key="detail_mode",
+    help="Sans le détail, les indicateurs sont calculés par la base (agrégats) : chargement bien plus léger."
+)
+yoy = st.toggle(
+    "📆 Comparer à N-1 (mêmes semaines ISO)", value=False, key="yoy",
+    help="Même période un an plus tôt, alignée sur les semaines ISO (un lundi face à un lundi). "
+         "Calculée à partir des totaux journaliers N-1 : une seule requête d'agrégat, mise en cache."
+)
+
+# ---------- Planificateur : estimation avant chargement, budget mémoire par session ----------
+@st.cache_resource
+def row_bytes() -> RowBytes:
+    return RowBytes()
+
+plan = plan_load(month_rows(), dstart, dend, detail_mode, row_bytes().value)
+if plan.unknown:
+    st.caption("📐 Estimation indisponible (statistiques de partitions absentes pour au moins un mois).")
+else:
+    st.caption(f"📐 Estimation : ~{plan.rows:,} lignes".replace(",", " ") +
+               f" · ~{format_bytes(plan.bytes)} en mémoire (budget par session : {format_bytes(plan.budget)})")
+if detail_mode and plan.over_budget:
+    plan_options = {"Agrégats seulement (toute la période)": "agregats"}
+    if plan.narrowed_start is not None:
+        plan_options[f"Agrégats sur toute la période + détail du {plan.narrowed_start} au {dend}"] = "reduit"
+    if plan.unknown:
+        st.warning("Volume de la période inconnu : le détail des lignes peut dépasser le budget de session.")
+        plan_options["Détail complet (interrompu s'il dépasse le budget)"] = "detail"
+    else:
+        st.warning("Période trop volumineuse pour charger tout le détail des lignes dans le budget de session.")
+    plan.strategy = plan_options[st.radio("Stratégie de chargement", list(plan_options), key="plan_choice")]
+
+if st.button("⚡ Charger / Actualiser les données", type="primary", key="load_btn"):
     st.session_state["stores_selected"] = selected_stores
-    st.session_state["df"] = load_data(dstart, dend)
+    # le plan a déjà écarté le détail hors budget ; load_data s'interrompt si l'estimation a sous-évalué
+    detail_range = {"detail": (dstart, dend), "reduit": (plan.narrowed_start, dend)}.get(plan.strategy)
+    df_new = None
+    if detail_range is not None:
+        try:
+            df_new = cached_call("load_data", load_data, *detail_range, data_version(*detail_range))
+        except BudgetExceeded as e:
+            perf.count("planner.aborted")
+            st.warning(f"Détail interrompu : plus de {format_bytes(e.used)} décodés pour un budget de session "
+                       f"de {format_bytes(e.budget)}. Affichage en agrégats.")
+            detail_range = None
+        else:
+            used = int(df_new.memory_usage(deep=True).sum())
+            row_bytes().observe(len(df_new), used)
+            perf.count("planner.bytes", used)
+    st.session_state["df"] = df_new
+    st.session_state["detail_range"] = detail_range
+    st.session_state["range_loaded"] = (dstart, dend)
+    # jeton de version : invalide les index de tri/filtre de la table détaillée
+    st.session_state["df_token"] = st.session_state.get("df_token", 0) + 1
 
 st.caption("Astuce : choisis 📅 la période, ⏱️ la granularité et 🏬 les magasins, puis clique sur ⚡ Charger.")
 
 # ---------- Récupération ----------
-df = st.session_state.get("df")
+range_loaded = st.session_state.get("range_loaded")
 stores_selected = st.session_state.get("stores_selected", [])
-if df is None:
+if range_loaded is None:
     st.info("Clique sur ⚡ Charger / Actualiser les données pour afficher le dashboard.")
-    st.stop()
-if df.empty:
+    stop_run()
+dstart_l, dend_l = range_loaded
+
+# Détail chargé sur toute la période -> groupbys pandas ; sinon agrégats calculés par la base
+df = st.session_state.get("df")
+detail_range = st.session_state.get("detail_range")
+if df is not None and detail_range == range_loaded:
+    agg = FrameAggregates(df)
+elif USE_DUCKDB:
+    with st.spinner("Synchronisation du snapshot local…"), perf.section("snapshot_sync"):
+        perf.count("snapshot.months_synced", len(sync_snapshot(dstart_l, dend_l)))
+    agg = DuckAggregates(dstart_l, dend_l)
+else:
+    agg = RpcAggregates(rpc_call, dstart_l, dend_l)
+try:
+    kpis = agg.kpis()
+except Exception as e:
+    fallback = plan_load(month_rows(), dstart_l, dend_l, True, row_bytes().value)
+    if not fallback.unknown and fallback.over_budget:
+        st.error(f"Agrégats serveur indisponibles ({e}) et période trop volumineuse pour le budget de session "
+                 f"(~{format_bytes(fallback.bytes)}) : réduis la période.")
+        stop_run()
+    st.warning(f"Agrégats serveur indisponibles ({e}) : chargement des lignes à la place.")
+    try:
+        df = cached_call("load_data", load_data, dstart_l, dend_l, data_version(dstart_l, dend_l))
+    except BudgetExceeded as over:
+        st.error(f"Période trop volumineuse pour le budget de session (plus de {format_bytes(over.used)} "
+                 f"décodés) : réduis la période.")
+        stop_run()
+    st.session_state["df"] = df
+    st.session_state["detail_range"] = detail_range = range_loaded
+    agg = FrameAggregates(df)
+    kpis = agg.kpis()
+if kpis["n_lignes"] == 0:
     st.warning("Aucune ligne pour ces filtres.")
-    st.stop()
+    stop_run()
+
+# ---------- Comparaison N-1 ----------
+# Totaux journaliers de la même période un an plus tôt (semaines ISO alignées), via la base ou
+# le snapshot : KPIs, courbe "Tous les magasins" et synthèse hebdo N-1 en sont tous dérivés.
+def prior_source(pstart: date, pend: date):
+    if USE_DUCKDB and not stale_months(pstart, pend, versions=month_versions(pstart, pend)):
+        return DuckAggregates(pstart, pend)
+    # mois N-1 absents du snapshot : totaux journaliers par la base, sans rapatrier les lignes
+    return RpcAggregates(rpc_call, pstart, pend)
+
+prior_src = prior = prior_kpis = None
+if yoy:
+    pstart, pend = iso_shift_years(dstart_l, -1), iso_shift_years(dend_l, -1)
+    try:
+        with perf.section("n_moins_1"):
+            prior_src = prior_source(pstart, pend)
+            prior_daily = prior_src.daily()
+    except Exception as e:
+        st.warning(f"Comparaison N-1 indisponible ({e}).")
+    else:
+        if prior_daily.empty:
+            st.info(f"Pas de données N-1 ({pstart} → {pend}).")
+        else:
+            prior = FrameAggregates(prior_daily)
+            prior_kpis = prior.kpis()
+            st.caption(f"📆 N-1 : {pstart} → {pend}")
 
 # ---------- KPIs ----------
 
-def kpi_card(title, value, emoji):
+def kpi_card(title, value, emoji, sub=None):
+    sub_html = f'<div style="font-size: 14px; color: #555; margin-top: 6px;">{sub}</div>' if sub else ""
     return f"""
     <div style="border: 3px solid red; border-radius: 12px; padding: 20px; text-align: center;
-    background-color: #fff; height: 120px; display: flex; flex-direction: column;
+    background-color: #fff; height: {150 if sub else 120}px; display: flex; flex-direction: column;
     justify-content: center; align-items: center;">
         <div style="font-size: 18px; font-weight: 600; color: #b00000; margin-bottom: 8px;">
             {emoji} {title}
@@ -241,9 +704,28 @@ def kpi_card(title, value, emoji):
         <div style="font-size: 32px; font-weight: bold; color: #000;">
             {value}
         </div>
+        {sub_html}
     </div>
     """
 
+def yoy_note(cur, prev, prev_txt):
+    """Ligne N-1 sous un KPI : valeur N-1 et évolution (▲ vert / ▼ rouge)."""
+    if prior_kpis is None:
+        return None
+    if not prev:
+        return f"N-1 : {prev_txt}"
+    delta = (cur - prev) / abs(prev) * 100
+    color = "#008000" if delta >= 0 else "#d00000"
+    arrow = "▲" if delta >= 0 else "▼"
+    return (f"N-1 : {prev_txt} · <span style='color:{color}; font-weight:600;'>"
+            f"{arrow} {delta:+.1f} %</span>".replace(".", ","))
+
+def fmt_eur(v):
+    return f"{v:,.2f} €".replace(",", " ").replace(".", ",")
+
+pk = prior_kpis or {c: 0.0 for c in kpis}
+
+perf.start("kpis")
 # ================================
 # 🔵 LIGNE 1 — KPI principaux
 # ================================
@@ -254,33 +736,37 @@ with row1_col1:
     st.markdown(
         kpi_card(
             "CA TTC",
-            f"{df['ventes_ttc'].sum():,.2f} €".replace(",", " ").replace(".", ","),
-            "💰"
+            f"{kpis['ventes_ttc']:,.2f} €".replace(",", " ").replace(".", ","),
+            "💰",
+            yoy_note(kpis["ventes_ttc"], pk["ventes_ttc"], fmt_eur(pk["ventes_ttc"]))
         ),
         unsafe_allow_html=True
     )
 
 # 2️⃣ Articles vendus (quantité totale)
 with row1_col2:
-    articles_total = df["qte"].sum()
+    articles_total = kpis["qte"]
     st.markdown(
         kpi_card(
             "Nombre d'articles vendus",
             f"{articles_total:,.0f}".replace(",", " "),
-            "🛒"
+            "🛒",
+            yoy_note(articles_total, pk["qte"], f"{pk['qte']:,.0f}".replace(",", " "))
         ),
         unsafe_allow_html=True
     )
 
 # 3️⃣ Prix moyen d’un article vendu
 with row1_col3:
-    total_ca = df["ventes_ttc"].sum()
+    total_ca = kpis["ventes_ttc"]
     prix_moyen = total_ca / articles_total if articles_total else 0
+    prix_moyen_n1 = pk["ventes_ttc"] / pk["qte"] if pk["qte"] else 0
     st.markdown(
         kpi_card(
             "Prix moyen d'article",
             f"{prix_moyen:,.2f} €".replace(",", " ").replace(".", ","),
-            "📦"
+            "📦",
+            yoy_note(prix_moyen, prix_moyen_n1, fmt_eur(prix_moyen_n1))
         ),
         unsafe_allow_html=True
     )
@@ -295,8 +781,9 @@ with row2_col1:
     st.markdown(
         kpi_card(
             "CA HT",
-            f"{df['ventes_ht'].sum():,.2f} €".replace(",", " ").replace(".", ","),
-            "📊"
+            f"{kpis['ventes_ht']:,.2f} €".replace(",", " ").replace(".", ","),
+            "📊",
+            yoy_note(kpis["ventes_ht"], pk["ventes_ht"], fmt_eur(pk["ventes_ht"]))
         ),
         unsafe_allow_html=True
     )
@@ -306,95 +793,224 @@ with row2_col2:
     st.markdown(
         kpi_card(
             "Marge HT",
-            f"{df['marge_ht'].sum():,.2f} €".replace(",", " ").replace(".", ","),
-            "🏦"
+            f"{kpis['marge_ht']:,.2f} €".replace(",", " ").replace(".", ","),
+            "🏦",
+            yoy_note(kpis["marge_ht"], pk["marge_ht"], fmt_eur(pk["marge_ht"]))
         ),
         unsafe_allow_html=True
     )
 
 # 6️⃣ Marge %
 with row2_col3:
-    pct = (df["marge_ht"].sum() / df["ventes_ht"].sum() * 100) if df["ventes_ht"].sum() else 0
+    pct = (kpis["marge_ht"] / kpis["ventes_ht"] * 100) if kpis["ventes_ht"] else 0
+    pct_n1 = (pk["marge_ht"] / pk["ventes_ht"] * 100) if pk["ventes_ht"] else 0
     st.markdown(
         kpi_card(
             "Marge %",
             f"{pct:,.2f} %".replace(",", " ").replace(".", ","),
-            "🔥"
+            "🔥",
+            yoy_note(pct, pct_n1, f"{pct_n1:,.2f} %".replace(",", " ").replace(".", ","))
         ),
         unsafe_allow_html=True
     )
 
 st.divider()
 
+# ---------- Affichage des graphiques (avec taille de la charge envoyée) ----------
+def show_chart(chart):
+    with perf.section("graphiques"):
+        st.altair_chart(chart, use_container_width=True)
+    if perf_detail:
+        # deuxième sérialisation de la spec : mesurée seulement à la demande
+        size = payload_bytes(chart)
+        perf.count("charts.bytes", size)
+        st.caption(f"📦 Données du graphique : {format_bytes(size)}")
+
 # ---------- Courbe comparative ----------
-def aggregate(df_in: pd.DataFrame, granularity: str, by_store=True) -> pd.DataFrame:
-    dfg = df_in.copy()
-    if granularity == "Jour":
-        dfg["bucket"] = dfg["period_date"].dt.date
-        dfg["bucket_label"] = dfg["bucket"].astype(str)
-    elif granularity == "Semaine":
-        dfg["bucket_start"] = dfg["period_date"] - pd.to_timedelta(dfg["period_date"].dt.weekday, unit="D")
-        dfg["bucket_end"] = dfg["bucket_start"] + pd.to_timedelta(6, unit="D")
-        dfg["bucket"] = dfg["bucket_start"]
-        dfg["bucket_label"] = "du " + dfg["bucket_start"].dt.strftime("%d/%m/%Y") + " au " + dfg["bucket_end"].dt.strftime("%d/%m/%Y")
-    else:  # Mois
-        dfg["bucket"] = dfg["period_date"].dt.to_period("M").dt.to_timestamp()
-        dfg["bucket_label"] = dfg["bucket"].dt.strftime("%b %Y")
-
-    group_cols = ["bucket", "bucket_label"]
-    if by_store:
-        group_cols.insert(0, "store_name")
-
-    out = (dfg.groupby(group_cols, as_index=False)
-              .agg(ca_ttc=("ventes_ttc", "sum"),
-                   ca_ht=("ventes_ht", "sum"),
-                   marge=("marge_ht", "sum"),
-                   qte=("qte", "sum")))
-    return out
+perf.start("comparaison")
 
 if stores_selected:
     comp_list = []
     if "Tous les magasins" in stores_selected:
-        agg_all = aggregate(df, granularity, by_store=False)
+        agg_all = agg.series(granularity, by_store=False)
         agg_all["magasin"] = "Tous les magasins"
         comp_list.append(agg_all)
-    for store in [s for s in stores_selected if s != "Tous les magasins"]:
-        df_store = df[df["store_name"] == store]
-        agg_store = aggregate(df_store, granularity, by_store=True)
-        agg_store["magasin"] = store
-        comp_list.append(agg_store)
-    comp = pd.concat(comp_list, ignore_index=True)
+    compared = [s for s in stores_selected if s != "Tous les magasins"]
+    if compared:
+        agg_stores = agg.series(granularity, stores=compared, by_store=True)
+        agg_stores["magasin"] = agg_stores["store_name"]
+        comp_list.append(agg_stores)
+    comp = pd.concat(comp_list, ignore_index=True).drop(columns=["store_name"], errors="ignore")
+    comp["periode"] = "N"
+
+    # N-1 : mêmes séries un an plus tôt, replacées sur l'axe de N (trait pointillé)
+    curve_src, curve_prior = prior_src, prior
+    if prior is not None and granularity == "Mois":
+        # mois calendaires : la fenêtre ISO N-1 chevauche les mois voisins, on relit la même plage
+        # de dates un an plus tôt (totaux journaliers, mis en cache comme le reste)
+        cstart = (pd.Timestamp(dstart_l) - pd.DateOffset(years=1)).date()
+        cend = (pd.Timestamp(dend_l) - pd.DateOffset(years=1)).date()
+        try:
+            curve_src = prior_source(cstart, cend)
+            curve_prior = FrameAggregates(curve_src.daily())
+        except Exception as e:
+            st.caption(f"ℹ️ Courbe N-1 mensuelle indisponible ({e}).")
+            curve_prior = None
+    if curve_prior is not None:
+        prior_list = []
+        if "Tous les magasins" in stores_selected:
+            prior_list.append(curve_prior.series(granularity, by_store=False).assign(magasin="Tous les magasins"))
+        if compared:
+            prior_stores = FrameAggregates(curve_src.daily(stores=compared, by_store=True))
+            if not prior_stores.df.empty:
+                prior_by_store = prior_stores.series(granularity, by_store=True)
+                prior_list.append(prior_by_store.assign(magasin=prior_by_store["store_name"]))
+        if prior_list:
+            comp_n1 = pd.concat(prior_list, ignore_index=True).drop(columns=["store_name"], errors="ignore")
+            comp_n1["bucket"] = align_prior_buckets(pd.to_datetime(comp_n1["bucket"]), granularity)
+            comp = pd.concat([comp, comp_n1.assign(periode="N-1")], ignore_index=True)
 
     st.markdown(f"<p style='font-size:22px; font-weight:700;'>📈 Comparaison des magasins — CA TTC ({granularity})</p>", unsafe_allow_html=True)
+
+    # Beaucoup de magasins : top-K + "Autres magasins"
+    if comp["magasin"].nunique() > TOP_K_STORES:
+        if st.checkbox(f"Regrouper les magasins au-delà des {TOP_K_STORES} premiers (CA TTC)", value=True):
+            comp = top_k_with_other(comp, "magasin", "ca_ttc", TOP_K_STORES,
+                                    sum_cols=["ca_ttc", "ca_ht", "marge", "qte"], other_label=f"{AUTRES} magasins")
+
+    # Longues séries journalières : sous-échantillonnage LTTB, mêmes jours pour tous les magasins
+    n_points = len(comp)
+    if granularity == "Jour":
+        comp = downsample_series(comp, "bucket", "ca_ttc")
+    if len(comp) < n_points:
+        st.caption(f"ℹ️ Série allégée : {len(comp)} points affichés sur {n_points} (passer en Semaine/Mois pour le détail agrégé).")
+
+    comp = comp.sort_values("bucket", kind="mergesort")
+    comp["bucket_label"] = bucket_labels(pd.to_datetime(comp["bucket"]), granularity)
+    comp = comp[["magasin", "periode", "bucket_label", "ca_ttc", "ca_ht", "marge", "qte"]]
     line_comp = alt.Chart(comp).mark_line(point=True).encode(
     x=alt.X("bucket_label:N", title=f"Période ({granularity})", sort=None),
     y=alt.Y("ca_ttc:Q", title="CA TTC"),
     color=alt.Color("magasin:N", title="Magasin", scale=alt.Scale(scheme="category20")),  # ✅ category20
-    tooltip=["magasin","bucket_label",
+    strokeDash=alt.StrokeDash("periode:N", title="Période", scale=alt.Scale(domain=["N", "N-1"], range=[[1, 0], [6, 4]])),
+    tooltip=["magasin","periode","bucket_label",
              alt.Tooltip("ca_ttc:Q", format=".2f"),
              alt.Tooltip("ca_ht:Q", format=".2f"),
              alt.Tooltip("marge:Q", format=".2f"),
              alt.Tooltip("qte:Q", format=".0f")]
     ).properties(height=320).configure_mark(strokeWidth=3)
-    st.altair_chart(line_comp, use_container_width=True)
+    show_chart(line_comp)
+
+st.divider()
+
+# ---------- Classement du réseau ----------
+# Tous les magasins en une requête groupée (magasin × semaine ISO) : classement coloré paginé
+# + heatmap des semaines pour les magasins de la page.
+perf.start("classement")
+st.markdown("<p style='font-size:22px; font-weight:700;'>🏆 Classement des magasins du réseau</p>", unsafe_allow_html=True)
+
+LEADERBOARD_SORTS = {"CA TTC": "ca_ttc", "Marge %": "marge_pct", "Prix moyen d'article": "prix_moyen",
+                     "Évolution S/S-1": "evol_pct"}
+LEADERBOARD_PAGE = 25
+
+# dernière semaine ISO complète de la période, comparée à la précédente
+last_full = dend_l if dend_l.isoweekday() == 7 else dend_l - timedelta(days=dend_l.isoweekday())
+last_week = tuple(last_full.isocalendar())[:2]
+prev_week = tuple((last_full - timedelta(days=7)).isocalendar())[:2]
+
+sw = agg.store_weeks()
+board = store_leaderboard(sw, last_week, prev_week)
+
+lb_cols = st.columns([2, 1, 3])
+with lb_cols[0]:
+    lb_sort = st.selectbox("Classer par", list(LEADERBOARD_SORTS), key="lb_sort")
+with lb_cols[1]:
+    lb_asc = st.toggle("Croissant", value=False, key="lb_asc")
+with lb_cols[2]:
+    lb_search = st.text_input("🔎 Filtrer les magasins", key="lb_search")
+
+view = board.sort_values(LEADERBOARD_SORTS[lb_sort], ascending=lb_asc, na_position="last", kind="mergesort")
+view = view.assign(rang=range(1, len(view) + 1))
+if lb_search:
+    view = view[view["store_name"].str.contains(lb_search, case=False, regex=False)]
+
+lb_pages = max(1, -(-len(view) // LEADERBOARD_PAGE))
+if st.session_state.get("lb_page", 1) > lb_pages:
+    st.session_state["lb_page"] = 1
+lb_page = st.number_input(f"Page (sur {lb_pages})", min_value=1, max_value=lb_pages, step=1, key="lb_page")
+page_view = view.iloc[(lb_page - 1) * LEADERBOARD_PAGE: lb_page * LEADERBOARD_PAGE]
+
+def heat_scale(values: pd.Series, centered=False):
+    """Bornes de couleur sur tout le réseau (5e-95e centiles), pour des couleurs stables d'une page à l'autre."""
+    v = values.dropna()
+    if v.empty:
+        return 0.0, 0.0
+    if centered:
+        m = float(v.abs().quantile(0.95))
+        return -m, m
+    return float(v.quantile(0.05)), float(v.quantile(0.95))
+
+def heat_cell(val, bounds, text):
+    if pd.isna(val):
+        return "—"
+    lo, hi = bounds
+    t = 0.5 if hi <= lo else min(max((val - lo) / (hi - lo), 0.0), 1.0)
+    return (f"<div style='background-color:hsl({int(120 * t)}, 70%, 82%); border-radius:8px; "
+            f"padding:6px 12px; text-align:center; color:#000;'>{text}</div>")
+
+bounds = {
+    "ca_ttc": heat_scale(board["ca_ttc"]),
+    "marge_pct": heat_scale(board["marge_pct"]),
+    "prix_moyen": heat_scale(board["prix_moyen"]),
+    "evol_pct": heat_scale(board["evol_pct"], centered=True),
+}
+sem_label = f"S{last_week[1]:02d}"
+prev_label = f"S{prev_week[1]:02d}"
+table_lb = pd.DataFrame({
+    "Rang": page_view["rang"].values,
+    "Magasin": page_view["store_name"].values,
+    "CA TTC": [heat_cell(v, bounds["ca_ttc"], fmt_eur(v)) for v in page_view["ca_ttc"]],
+    "Marge %": [heat_cell(v, bounds["marge_pct"], f"{v:.2f} %".replace(".", ",")) for v in page_view["marge_pct"]],
+    "Prix moyen d'article": [heat_cell(v, bounds["prix_moyen"], fmt_eur(v)) for v in page_view["prix_moyen"]],
+    f"CA {prev_label}": [fmt_eur(v) for v in page_view["ca_sem_prec"]],
+    f"CA {sem_label}": [fmt_eur(v) for v in page_view["ca_sem"]],
+    f"Évol. {sem_label}/{prev_label}": [heat_cell(v, bounds["evol_pct"], f"{v:+.1f} %".replace(".", ","))
+                                         for v in page_view["evol_pct"]],
+})
+html_lb = table_lb.to_html(escape=False, index=False, border=0)
+perf.count("html.bytes", len(html_lb))
+st.markdown(f"<div class='scrollable-table'>{html_lb}</div>", unsafe_allow_html=True)
+st.caption(f"{len(view)} magasins · évolution : semaine ISO {sem_label} ({last_week[0]}) vs {prev_label} — "
+           "couleurs relatives à l'ensemble du réseau.")
+
+# Heatmap CA TTC magasin × semaine (magasins de la page, dans l'ordre du classement)
+if not page_view.empty:
+    hm = sw[sw["store_name"].isin(page_view["store_name"])]
+    hm = hm.sort_values(["iso_year", "iso_week"], kind="mergesort").assign(
+        semaine="S" + hm["iso_week"].astype(str).str.zfill(2) + "-" + hm["iso_year"].astype(str)
+    )[["store_name", "semaine", "ventes_ttc"]]
+    heatmap = alt.Chart(hm).mark_rect().encode(
+        x=alt.X("semaine:N", title="Semaine ISO", sort=None),
+        y=alt.Y("store_name:N", title="Magasin", sort=list(page_view["store_name"])),
+        color=alt.Color("ventes_ttc:Q", title="CA TTC", scale=alt.Scale(scheme="redyellowgreen")),
+        tooltip=["store_name", "semaine", alt.Tooltip("ventes_ttc:Q", format=".2f")]
+    ).properties(height=max(200, 18 * len(page_view)))
+    show_chart(heatmap)
 
 st.divider()
 
 # ---------- Camembert ----------
+perf.start("camembert")
 st.markdown("<p style='font-size:22px; font-weight:700;'>🥧 Répartition du CA TTC par famille</p>", unsafe_allow_html=True)
 
+all_stores_label = f"Tous magasins ({dstart_l} → {dend_l})"
 target_for_pie = st.selectbox(
     "Choisir le magasin pour le camembert",
-    options=[f"Tous magasins ({dstart} → {dend})"] + stores_selected,
+    options=[all_stores_label] + [s for s in stores_selected if s != "Tous les magasins"],
     index=0
 )
-if target_for_pie == f"Tous magasins ({dstart} → {dend})":
-    pie_df = df.copy()
-else:
-    pie_df = df[df["store_name"] == target_for_pie].copy()
-
-fam = (pie_df.groupby("famille_finale", as_index=False)
-              .agg(ca_ttc=("ventes_ttc", "sum")))
+fam = agg.familles(None if target_for_pie == all_stores_label else [target_for_pie])
+fam = top_k_with_other(fam, "famille_finale", "ca_ttc", TOP_K_FAMILIES, other_label=f"{AUTRES} familles")
 fam["pct"] = fam["ca_ttc"] / fam["ca_ttc"].sum() * 100 if fam["ca_ttc"].sum() else 0
 
 # Trier du plus grand au plus petit
@@ -419,36 +1035,38 @@ pie = alt.Chart(fam).mark_arc().encode(
     ]
 ).properties(height=360)
 
-st.altair_chart(pie, use_container_width=True)
+show_chart(pie)
 
 st.divider()
 
 # ---------- Top articles ----------
+perf.start("top_articles")
 st.markdown("<p style='font-size:22px; font-weight:700;'>🏆 Top articles (par CA TTC)</p>", unsafe_allow_html=True)
-topn = st.slider(label="", min_value=5, max_value=50, value=15, step=5, label_visibility="collapsed")
+topn = st.slider(label="", min_value=5, max_value=50, value=TOP_DEFAULT, step=5, label_visibility="collapsed", key="topn")
 
-df_for_top = df.copy()
+top_stores = None
 if stores_selected and "Tous les magasins" not in stores_selected:
-    df_for_top = df_for_top[df_for_top["store_name"].isin(stores_selected)]
+    top_stores = stores_selected
 
-top_articles = (df_for_top.groupby(["code_article", "libelle_final"], as_index=False)
-                .agg(qte=("qte", "sum"),
-                     ca_ttc=("ventes_ttc", "sum")))
+top_articles = agg.top_articles(topn, stores=top_stores)
 top_articles["article"] = top_articles.apply(
     lambda r: f"{r['libelle_final']} [{r['code_article']}]",
     axis=1
 )
 
-top_articles = top_articles.sort_values("ca_ttc", ascending=False).head(topn)
+top_articles = top_articles.sort_values("ca_ttc", ascending=False)[
+    ["article", "code_article", "libelle_final", "qte", "ca_ttc"]
+]
 
 bar = alt.Chart(top_articles).mark_bar().encode(
     x=alt.X("ca_ttc:Q", title="CA TTC"),
     y=alt.Y("article:N", sort="-x", title="Article"),
     tooltip=["code_article", "libelle_final", "qte", "ca_ttc"]
 ).properties(height=max(280, 28*len(top_articles)))
-st.altair_chart(bar, use_container_width=True)
+show_chart(bar)
 
 # ---------- Synthèse Tickets & CA TTC ----------
+perf.start("synthese_semaines")
 st.markdown("## 📊 Synthèse Articles & CA TTC")
 
 JOURS = ["Lundi","Mardi","Mercredi","Jeudi","Vendredi","Samedi","Dimanche"]
@@ -569,8 +1187,10 @@ def render_table(df, euro=False):
         for col in df.columns:
             if col == "Jour":
                 fmt.loc[idx, col] = df.loc[idx, col]
-            elif col == "Moyenne":
-                if euro:
+            elif col in ("Moyenne", "Moyenne N-1"):
+                if pd.isna(df.loc[idx, col]):
+                    fmt.loc[idx, col] = "—"
+                elif euro:
                     fmt.loc[idx, col] = f"{df.loc[idx, col]:,.2f} €".replace(",", " ").replace(".", ",")
                 else:
                     fmt.loc[idx, col] = f"{df.loc[idx, col]:.2f}"
@@ -578,41 +1198,65 @@ def render_table(df, euro=False):
                 fmt.loc[idx, col] = format_cell(df.loc[idx, col], base, euro=euro)
 
     html_table = fmt.to_html(escape=False, index=False, border=0)
+    perf.count("html.bytes", len(html_table))
     return f"<div class='scrollable-table'>{html_table}</div>"
 
-# --- Fonction export CSV ---
+# --- Fonction export CSV (générée uniquement à la demande) ---
 def get_csv_download_link(df, filename):
-    csv = df.to_csv(index=False, sep=";", encoding="utf-8")
+    key = f"export_{filename}"
+    # empreinte du tableau affiché : tout changement (rechargement, N-1, filtres) invalide le CSV préparé
+    token = (tuple(map(str, df.columns)), int(pd.util.hash_pandas_object(df, index=True).sum()))
+    ready = st.session_state.get(key)
+    if ready is None or ready[0] != token:
+        if not st.button(f"📄 Préparer {filename}.csv", key=f"prep_{filename}"):
+            return None
+        ready = (token, df.to_csv(index=False, sep=";", encoding="utf-8"))
+        st.session_state[key] = ready
     return st.download_button(
         label=f"📥 Télécharger {filename}",
-        data=csv,
+        data=ready[1],
         file_name=f"{filename}.csv",
         mime="text/csv"
     )
 # --- Semaine ISO (année + semaine) pour ordre correct ---
-iso = df["period_date"].dt.isocalendar()
-df = df.assign(
-    iso_year=iso.year.astype(int),
-    iso_week=iso.week.astype(int),
-    iso_key=(iso.year.astype(int) * 100 + iso.week.astype(int)),  # ex: 202601
+# Matrice jour × semaine ISO (qte, CA TTC), déjà agrégée : base de toutes les synthèses ci-dessous
+dw = agg.dow_week()
+dw = dw.assign(
+    iso_key=(dw["iso_year"] * 100 + dw["iso_week"]),  # ex: 202601
     iso_label=(  # ex: S01-2026
-        "S" + iso.week.astype(int).astype(str).str.zfill(2) + "-" + iso.year.astype(int).astype(str)
-    )
+        "S" + dw["iso_week"].astype(str).str.zfill(2) + "-" + dw["iso_year"].astype(str)
+    ),
+    jour=(dw["isodow"] - 1).map(JOURS_MAP)
 )
-key_to_label = df.drop_duplicates("iso_key").set_index("iso_key")["iso_label"].to_dict()
+key_to_label = dw.drop_duplicates("iso_key").set_index("iso_key")["iso_label"].to_dict()
+
+# N-1 : même matrice sur les semaines ISO de l'an passé -> colonne « Moyenne N-1 »
+dw_n1 = None
+if prior is not None:
+    dw_n1 = prior.dow_week()
+    dw_n1 = dw_n1.assign(jour=(dw_n1["isodow"] - 1).map(JOURS_MAP))
+
+def prior_week_matrix(value):
+    return dw_n1.pivot_table(index="jour", columns=["iso_year", "iso_week"], values=value, aggfunc="sum")
+
+def add_prior_mean(tab, per_day, total):
+    """Insère « Moyenne N-1 » (par jour, puis ligne TOTAL) juste avant « Moyenne »."""
+    vals = tab["Jour"].map(per_day).astype("float64")
+    vals[tab["Jour"] == "TOTAL"] = total
+    tab.insert(tab.columns.get_loc("Moyenne"), "Moyenne N-1", vals.values)
+    return tab
 # --- Tickets (quantités) ---
 tickets = (
-    df.assign(jour=df["period_date"].dt.weekday.map(JOURS_MAP))
-      .groupby(["jour", "iso_key"])["qte"].sum()
+    dw.groupby(["jour", "iso_key"])["qte"].sum()
       .unstack()
       .reindex(JOURS)
 )
 # Renommer colonnes avec label lisible
-col_map = df.drop_duplicates("iso_key").set_index("iso_key")["iso_label"].to_dict()
+col_map = key_to_label
 tickets = tickets.rename(columns=col_map)
 
 # ✅ Ordonner colonnes du plus récent au plus ancien
-ordered_keys_desc = sorted(df["iso_key"].dropna().unique(), reverse=True)
+ordered_keys_desc = sorted(dw["iso_key"].dropna().unique(), reverse=True)
 ordered_labels_desc = [col_map[k] for k in ordered_keys_desc if k in col_map and col_map[k] in tickets.columns]
 tickets = tickets[ordered_labels_desc]
 
@@ -629,6 +1273,9 @@ totals_row_t = tickets[ordered_labels_desc].sum(numeric_only=True)
 totals_row_t["Jour"] = "TOTAL"
 totals_row_t["Moyenne"] = totals_row_t[ordered_labels_desc].mean()
 tickets = pd.concat([tickets, totals_row_t.to_frame().T], ignore_index=True)
+if dw_n1 is not None:
+    q_n1 = prior_week_matrix("qte")
+    tickets = add_prior_mean(tickets, q_n1.mean(axis=1), q_n1.sum().mean())
 
 st.markdown("### 🎟️ Synthèse des articles vendus (quantités) par semaine")
 st.markdown(render_table(tickets, euro=False), unsafe_allow_html=True)
@@ -636,18 +1283,17 @@ get_csv_download_link(tickets, "tickets")
 
 # --- CA TTC ---
 ca = (
-    df.assign(jour=df["period_date"].dt.weekday.map(JOURS_MAP))
-      .groupby(["jour", "iso_key"])["ventes_ttc"].sum()
+    dw.groupby(["jour", "iso_key"])["ventes_ttc"].sum()
       .unstack()
       .reindex(JOURS)
 )
 
 # Renommer colonnes avec label lisible
-col_map = df.drop_duplicates("iso_key").set_index("iso_key")["iso_label"].to_dict()
+col_map = key_to_label
 ca = ca.rename(columns=col_map)
 
 # ✅ Ordonner colonnes du plus récent au plus ancien
-ordered_keys_desc = sorted(df["iso_key"].dropna().unique(), reverse=True)
+ordered_keys_desc = sorted(dw["iso_key"].dropna().unique(), reverse=True)
 ordered_labels_desc = [col_map[k] for k in ordered_keys_desc if k in col_map and col_map[k] in ca.columns]
 ca = ca[ordered_labels_desc]
 
@@ -664,15 +1310,16 @@ totals_row_c = ca[ordered_labels_desc].sum(numeric_only=True)
 totals_row_c["Jour"] = "TOTAL"
 totals_row_c["Moyenne"] = totals_row_c[ordered_labels_desc].mean()
 ca = pd.concat([ca, totals_row_c.to_frame().T], ignore_index=True)
+if dw_n1 is not None:
+    ca_n1 = prior_week_matrix("ventes_ttc")
+    ca = add_prior_mean(ca, ca_n1.mean(axis=1), ca_n1.sum().mean())
 
 st.markdown("### 💶 Synthèse CA TTC par semaine")
 st.markdown(render_table(ca, euro=True), unsafe_allow_html=True)
 get_csv_download_link(ca, "ca_ttc")
 
 # --- Panier moyen ---
-panier = df.assign(
-    jour=df["period_date"].dt.weekday.map(JOURS_MAP)
-).groupby(["iso_key","jour"]).agg(
+panier = dw.groupby(["iso_key","jour"]).agg(
     tickets=("qte", "sum"),
     ca_ttc=("ventes_ttc", "sum")
 ).reset_index()
@@ -683,10 +1330,10 @@ panier["panier_moyen"] = panier["ca_ttc"] / panier["tickets"]
 # Pivot
 panier_tab = panier.pivot(index="jour", columns="iso_key", values="panier_moyen").reindex(JOURS)
 
-col_map = df.drop_duplicates("iso_key").set_index("iso_key")["iso_label"].to_dict()
+col_map = key_to_label
 panier_tab = panier_tab.rename(columns=col_map)
 
-ordered_keys_desc = sorted(df["iso_key"].dropna().unique(), reverse=True)
+ordered_keys_desc = sorted(dw["iso_key"].dropna().unique(), reverse=True)
 ordered_labels_desc = [col_map[k] for k in ordered_keys_desc if k in col_map and col_map[k] in panier_tab.columns]
 panier_tab = panier_tab[ordered_labels_desc]
 
@@ -701,186 +1348,276 @@ for col in ordered_labels_desc:
     totals_row_pm[col] = panier_tab[col].mean()
 
 panier_tab = pd.concat([panier_tab, totals_row_pm.to_frame().T], ignore_index=True)
+if dw_n1 is not None:
+    pm_n1 = prior_week_matrix("ventes_ttc") / prior_week_matrix("qte")
+    panier_tab = add_prior_mean(panier_tab, pm_n1.mean(axis=1), pm_n1.mean().mean())
 
 # Affichage
 st.markdown("### 🛒 Synthèse Prix moyen d'article par semaine")
 st.markdown(render_table(panier_tab.round(2), euro=True), unsafe_allow_html=True)
 get_csv_download_link(panier_tab.round(2), "panier_moyen")
 
-# ---------- Graphiques comparatifs par semaine (3 dernières + Moyenne) ----------
-# ⚠️ PRÉ-REQUIS : key_to_label doit déjà exister plus haut (tu l'as déjà ajouté ✅)
+# ---------- Graphiques comparatifs par semaine (N dernières + Moyennes) ----------
+perf.start("graphiques_semaines")
+# Lectures dans l'index (magasin, semaine ISO, jour) : changer N, le magasin ou les moyennes
+# glissantes ne relance ni requête ni passage sur les lignes.
 
 # Liste ordonnée des jours
 JOURS = ["Lundi","Mardi","Mercredi","Jeudi","Vendredi","Samedi","Dimanche"]
 JOURS_MAP = {0:"Lundi",1:"Mardi",2:"Mercredi",3:"Jeudi",4:"Vendredi",5:"Samedi",6:"Dimanche"}
 
-def _last_weeks_keys(df_in, n=3):
-    uniq = sorted(df_in["iso_key"].dropna().unique())
-    return uniq[-n:] if len(uniq) >= n else uniq
-
-LAST_WEEKS_KEYS = _last_weeks_keys(df, n=3)
-
-# ✅ labels des 3 dernières semaines (ordre chrono)
-LAST_WEEKS_LABELS = [key_to_label[k] for k in LAST_WEEKS_KEYS if k in key_to_label]
+dlo, dhi = dow_index_range(dstart_l, dend_l, dmin)
+try:
+    with perf.section("index_jours"):
+        dow_idx = cached_call("dow_index", dow_index, dlo, dhi, data_version(dlo, dhi))
+except Exception as e:
+    st.caption(f"ℹ️ Historique des moyennes glissantes indisponible ({e}) : calcul sur la période chargée.")
+    dow_idx = DowIndex(agg.dow_week(by_store=True))
+
+wk_cols = st.columns([3, 2, 3])
+with wk_cols[0]:
+    wk_store = st.selectbox("🏬 Magasin", dow_idx.stores, key="wk_store")
+with wk_cols[1]:
+    wk_n = st.slider("Nombre de semaines", min_value=1, max_value=12, value=3, key="wk_n")
+with wk_cols[2]:
+    wk_baselines = st.multiselect("Moyennes glissantes", list(BASELINE_WEEKS), default=[],
+                                  format_func=lambda k: f"{k} dernières semaines", key="wk_baselines")
+
+# l'index remonte avant la période : la première semaine ne garde que les jours à partir de dstart_l
+period_start, first_day = dow_idx.start_of(dstart_l)
+week_lines = dow_idx.last_weeks(wk_store, wk_n, start=period_start, first_day=first_day)
+LAST_WEEKS_LABELS = list(dict.fromkeys(week_lines["semaine"]))
+ref_lines = [dow_idx.mean(wk_store, period_start, first_day=first_day).assign(semaine="Moyenne")]
+ref_lines += [dow_idx.trailing(wk_store, k).assign(semaine=f"Moyenne {k} sem.") for k in wk_baselines]
 
 # Couleur spéciale Moyenne
 MOYENNE_COLOR = "#1F7A8C"  # Bleu Manceau Fleurs
-
-# ✅ ordre FINAL : 3 semaines puis Moyenne
-ORDER_DOMAIN = LAST_WEEKS_LABELS + ["Moyenne"]
-ORDER_RANGE = ["#1f77b4", "#2ca02c", "#ff7f0e", MOYENNE_COLOR]
-
-if len(LAST_WEEKS_KEYS) == 0:
-    st.info("Pas de semaines disponibles sur la période choisie.")
-else:
-    # =========================================================
-    # 1) ARTICLES (qte)
-    # =========================================================
-    tickets_base = df.assign(
-        semaine=df["iso_label"],
-        jour=df["period_date"].dt.weekday.map(JOURS_MAP)
-    ).groupby(["semaine","jour"])["qte"].sum().reset_index()
-
-    # Moyenne (sur TOUTES les semaines de la période)
-    moy_tickets = tickets_base.groupby("jour", as_index=False)["qte"].mean()
-    moy_tickets["semaine"] = "Moyenne"
-
-    # Filtre 3 dernières semaines
-    tickets_sel = tickets_base[tickets_base["semaine"].isin(LAST_WEEKS_LABELS)].copy()
-
-    tickets_chart = pd.concat([tickets_sel, moy_tickets], ignore_index=True)
-
-    # ✅ ordre jour + ordre semaine (pas alphabétique)
-    tickets_chart["jour"] = pd.Categorical(tickets_chart["jour"], categories=JOURS, ordered=True)
-    tickets_chart["semaine"] = pd.Categorical(tickets_chart["semaine"], categories=ORDER_DOMAIN, ordered=True)
-    tickets_chart = tickets_chart.sort_values(["semaine","jour"])
-
-    st.markdown("### 📈 Évolution des Articles (qte) — 3 dernières semaines + Moyenne")
-
-    base_tickets = alt.Chart(tickets_chart[tickets_chart["semaine"]!="Moyenne"]).mark_line(
+WEEK_COLORS = ["#1f77b4", "#2ca02c", "#ff7f0e", "#d62728", "#9467bd", "#8c564b",
+               "#e377c2", "#17becf", "#bcbd22", "#7f7f7f", "#aec7e8", "#98df8a"]
+BASELINE_COLORS = {4: "#E07A5F", 8: "#81B29A", 13: "#3D405B"}
+
+# ✅ ordre FINAL : N semaines (chrono), Moyenne, puis moyennes glissantes
+ORDER_DOMAIN = LAST_WEEKS_LABELS + ["Moyenne"] + [f"Moyenne {k} sem." for k in wk_baselines]
+ORDER_RANGE = WEEK_COLORS[:len(LAST_WEEKS_LABELS)] + [MOYENNE_COLOR] + [BASELINE_COLORS[k] for k in wk_baselines]
+
+def dow_chart(value, y_title, fmt):
+    data = pd.concat([week_lines, *ref_lines], ignore_index=True)[["semaine", "jour", value]]
+    color = alt.Color("semaine:N", title="Semaine", scale=alt.Scale(domain=ORDER_DOMAIN, range=ORDER_RANGE))
+    tooltip = ["semaine", "jour", alt.Tooltip(f"{value}:Q", format=fmt)]
+    lines = alt.Chart(data[data["semaine"].isin(LAST_WEEKS_LABELS)]).mark_line(
         point=alt.OverlayMarkDef(size=70)
     ).encode(
         x=alt.X("jour:N", sort=JOURS, title="Jour de la semaine"),
-        y=alt.Y("qte:Q", title="Articles vendus (qte)"),
-        color=alt.Color("semaine:N", title="Semaine", scale=alt.Scale(domain=ORDER_DOMAIN, range=ORDER_RANGE)),
-        tooltip=["semaine","jour",alt.Tooltip("qte:Q", format=".0f")]
+        y=alt.Y(f"{value}:Q", title=y_title),
+        color=color,
+        tooltip=tooltip
     )
-
-    moy_line_tickets = alt.Chart(tickets_chart[tickets_chart["semaine"]=="Moyenne"]).mark_line(
+    refs = alt.Chart(data[~data["semaine"].isin(LAST_WEEKS_LABELS)]).mark_line(
         point=alt.OverlayMarkDef(size=70),
         strokeDash=[5,5],
         strokeWidth=3
     ).encode(
         x=alt.X("jour:N", sort=JOURS),
-        y="qte:Q",
-        color=alt.Color("semaine:N", scale=alt.Scale(domain=ORDER_DOMAIN, range=ORDER_RANGE)),
-        tooltip=["semaine","jour",alt.Tooltip("qte:Q", format=".0f")]
+        y=f"{value}:Q",
+        color=color,
+        tooltip=tooltip
     )
+    return (lines + refs).properties(height=400).configure_mark(strokeWidth=3)
 
-    st.altair_chart((base_tickets + moy_line_tickets).properties(height=400).configure_mark(strokeWidth=3),
-                    use_container_width=True)
+if not LAST_WEEKS_LABELS:
+    st.info("Pas de semaines disponibles sur la période choisie.")
+else:
+    titre = f"{len(LAST_WEEKS_LABELS)} dernières semaines + Moyenne"
+
+    # 1) ARTICLES (qte)
+    st.markdown(f"### 📈 Évolution des Articles (qte) — {titre}")
+    show_chart(dow_chart("qte", "Articles vendus (qte)", ".0f"))
 
     st.divider()
 
-    # =========================================================
     # 2) CA TTC
-    # =========================================================
-    ca_base = df.assign(
-        semaine=df["iso_label"],
-        jour=df["period_date"].dt.weekday.map(JOURS_MAP)
-    ).groupby(["semaine","jour"])["ventes_ttc"].sum().reset_index()
-
-    moy_ca = ca_base.groupby("jour", as_index=False)["ventes_ttc"].mean()
-    moy_ca["semaine"] = "Moyenne"
-
-    ca_sel = ca_base[ca_base["semaine"].isin(LAST_WEEKS_LABELS)].copy()
-    ca_chart_df = pd.concat([ca_sel, moy_ca], ignore_index=True)
-
-    ca_chart_df["jour"] = pd.Categorical(ca_chart_df["jour"], categories=JOURS, ordered=True)
-    ca_chart_df["semaine"] = pd.Categorical(ca_chart_df["semaine"], categories=ORDER_DOMAIN, ordered=True)
-    ca_chart_df = ca_chart_df.sort_values(["semaine","jour"])
-
-    st.markdown("### 📈 Évolution du CA TTC — 3 dernières semaines + Moyenne")
-
-    base_ca = alt.Chart(ca_chart_df[ca_chart_df["semaine"]!="Moyenne"]).mark_line(
-        point=alt.OverlayMarkDef(size=70)
-    ).encode(
-        x=alt.X("jour:N", sort=JOURS, title="Jour de la semaine"),
-        y=alt.Y("ventes_ttc:Q", title="CA TTC (€)"),
-        color=alt.Color("semaine:N", title="Semaine", scale=alt.Scale(domain=ORDER_DOMAIN, range=ORDER_RANGE)),
-        tooltip=["semaine","jour",alt.Tooltip("ventes_ttc:Q", format=".2f")]
-    )
-
-    moy_line_ca = alt.Chart(ca_chart_df[ca_chart_df["semaine"]=="Moyenne"]).mark_line(
-        point=alt.OverlayMarkDef(size=70),
-        strokeDash=[5,5],
-        strokeWidth=3
-    ).encode(
-        x=alt.X("jour:N", sort=JOURS),
-        y="ventes_ttc:Q",
-        color=alt.Color("semaine:N", scale=alt.Scale(domain=ORDER_DOMAIN, range=ORDER_RANGE)),
-        tooltip=["semaine","jour",alt.Tooltip("ventes_ttc:Q", format=".2f")]
-    )
-
-    st.altair_chart((base_ca + moy_line_ca).properties(height=400).configure_mark(strokeWidth=3),
-                    use_container_width=True)
+    st.markdown(f"### 📈 Évolution du CA TTC — {titre}")
+    show_chart(dow_chart("ventes_ttc", "CA TTC (€)", ".2f"))
 
     st.divider()
 
-    # =========================================================
-    # 3) PANIER MOYEN (= CA TTC / qte) par jour
-    # =========================================================
-    panier_chart = df.assign(
-        semaine=df["iso_label"],
-        jour=df["period_date"].dt.weekday.map(JOURS_MAP)
-    ).groupby(["semaine","jour"]).agg(
-        tickets=("qte", "sum"),
-        ca_ttc=("ventes_ttc", "sum")
-    ).reset_index()
-
-    panier_chart["panier_moyen"] = panier_chart["ca_ttc"] / panier_chart["tickets"].replace({0: pd.NA})
-
-    moy_pm = panier_chart.groupby("jour", as_index=False)["panier_moyen"].mean()
-    moy_pm["semaine"] = "Moyenne"
-
-    pm_sel = panier_chart[panier_chart["semaine"].isin(LAST_WEEKS_LABELS)].copy()
-
-    panier_chart_df = pd.concat(
-        [pm_sel[["semaine","jour","panier_moyen"]], moy_pm],
-        ignore_index=True
-    )
-
-    panier_chart_df["jour"] = pd.Categorical(panier_chart_df["jour"], categories=JOURS, ordered=True)
-    panier_chart_df["semaine"] = pd.Categorical(panier_chart_df["semaine"], categories=ORDER_DOMAIN, ordered=True)
-    panier_chart_df = panier_chart_df.sort_values(["semaine","jour"])
-
-    st.markdown("### 📈 Évolution du Prix moyen d'article — 3 dernières semaines + Moyenne")
-
-    base_pm = alt.Chart(panier_chart_df[panier_chart_df["semaine"]!="Moyenne"]).mark_line(
-        point=alt.OverlayMarkDef(size=70)
-    ).encode(
-        x=alt.X("jour:N", sort=JOURS, title="Jour de la semaine"),
-        y=alt.Y("panier_moyen:Q", title="Prix moyen d'article (€)"),
-        color=alt.Color("semaine:N", title="Semaine", scale=alt.Scale(domain=ORDER_DOMAIN, range=ORDER_RANGE)),
-        tooltip=["semaine","jour",alt.Tooltip("panier_moyen:Q", format=".2f")]
-    )
-
-    moy_line_pm = alt.Chart(panier_chart_df[panier_chart_df["semaine"]=="Moyenne"]).mark_line(
-        point=alt.OverlayMarkDef(size=70),
-        strokeDash=[5,5],
-        strokeWidth=3
-    ).encode(
-        x=alt.X("jour:N", sort=JOURS),
-        y="panier_moyen:Q",
-        color=alt.Color("semaine:N", scale=alt.Scale(domain=ORDER_DOMAIN, range=ORDER_RANGE)),
-        tooltip=["semaine","jour",alt.Tooltip("panier_moyen:Q", format=".2f")]
-    )
-
-    st.altair_chart((base_pm + moy_line_pm).properties(height=400).configure_mark(strokeWidth=3),
-                    use_container_width=True)
+    # 3) PRIX MOYEN D'ARTICLE (= CA TTC / qte) par jour
+    st.markdown(f"### 📈 Évolution du Prix moyen d'article — {titre}")
+    show_chart(dow_chart("panier_moyen", "Prix moyen d'article (€)", ".2f"))
 # ---------- Table détaillée ----------
+perf.start("detail")
 st.markdown("<p style='font-size:22px; font-weight:700;'>📋 Détail des lignes (période sélectionnée)</p>", unsafe_allow_html=True)
-st.dataframe(
-    df.sort_values(["period_date", "store_name", "libelle_final"]),
-    use_container_width=True
-)
+
+DETAIL_COLUMNS = ["period_date", "store_name", "code_article", "libelle_final", "famille_finale",
+                  "qte", "ventes_ht", "ventes_ttc", "marge_ht", "marge_pct"]
+DETAIL_SORTS = {
+    "Date": "period_date",
+    "Magasin": "store_name",
+    "Article": "libelle_final",
+    "Famille": "famille_finale",
+    "Qté": "qte",
+    "CA TTC": "ventes_ttc",
+    "Marge HT": "marge_ht",
+}
+DETAIL_TIEBREAK = ["period_date", "store_name", "libelle_final"]
+
+def detail_index(df_in: pd.DataFrame, sort_col: str, ascending: bool, search: str) -> pd.Index:
+    """Index des lignes filtrées et triées ; seule la page visible est envoyée au navigateur."""
+    dfd = df_in
+    if search:
+        mask = pd.Series(False, index=dfd.index)
+        for c in ["store_name", "code_article", "libelle_final", "famille_finale"]:
+            if c in dfd.columns:
+                mask |= dfd[c].astype(str).str.contains(search, case=False, regex=False, na=False)
+        dfd = dfd[mask]
+    by = [sort_col] + [c for c in DETAIL_TIEBREAK if c != sort_col and c in dfd.columns]
+    return dfd.sort_values(by, ascending=[ascending] + [True] * (len(by) - 1), kind="mergesort").index
+
+if df is None and not hasattr(agg, "detail_page"):
+    st.info("Mode agrégé : active 📋 « Charger aussi le détail des lignes » puis ⚡ Charger pour parcourir les lignes.")
+else:
+    if df is not None and detail_range != range_loaded:
+        st.caption(f"ℹ️ Détail limité au {detail_range[0]} → {detail_range[1]} (budget mémoire de session) ; "
+                   "les indicateurs ci-dessus couvrent toute la période.")
+    col_detail = st.columns([2, 1, 3, 1])
+    with col_detail[0]:
+        detail_sort_label = st.selectbox("Trier par", list(DETAIL_SORTS.keys()), index=0, key="detail_sort")
+    with col_detail[1]:
+        detail_asc = st.radio("Ordre", ["↑", "↓"], horizontal=True, key="detail_order") == "↑"
+    with col_detail[2]:
+        detail_search = st.text_input("Filtrer (magasin, code, libellé, famille)", key="detail_search").strip()
+    with col_detail[3]:
+        detail_page_size = st.selectbox("Lignes / page", [50, 100, 250, 500], index=1, key="detail_page_size")
+
+    def duck_page(page_no):
+        return agg.detail_page(DETAIL_SORTS[detail_sort_label], detail_asc, detail_search, detail_page_size,
+                               (page_no - 1) * detail_page_size, DETAIL_COLUMNS, DETAIL_TIEBREAK)
+
+    if df is not None:
+        # Le tri/filtre n'est recalculé que si les paramètres ou les données changent
+        detail_key = (st.session_state.get("df_token", 0), DETAIL_SORTS[detail_sort_label], detail_asc, detail_search)
+        detail_cache = st.session_state.get("detail_cache")
+        if detail_cache is None or detail_cache["key"] != detail_key:
+            detail_cache = {"key": detail_key, "index": detail_index(df, DETAIL_SORTS[detail_sort_label], detail_asc, detail_search)}
+            st.session_state["detail_cache"] = detail_cache
+        detail_idx = detail_cache["index"]
+        n_detail = len(detail_idx)
+    else:
+        # Snapshot DuckDB : tri, filtre et fenêtre exécutés par le moteur, seule la page est matérialisée
+        n_detail, detail_rows = duck_page(int(st.session_state.get("detail_page", 1)))
+
+    n_pages = max(1, -(-n_detail // detail_page_size))
+    if st.session_state.get("detail_page", 1) > n_pages:
+        st.session_state["detail_page"] = 1
+        if df is None:
+            n_detail, detail_rows = duck_page(1)
+    detail_page = st.number_input(f"Page (sur {n_pages})", min_value=1, max_value=n_pages, step=1, key="detail_page")
+    first = (int(detail_page) - 1) * detail_page_size
+    last = min(first + detail_page_size, n_detail)
+
+    st.dataframe(
+        df.loc[detail_idx[first:last], [c for c in DETAIL_COLUMNS if c in df.columns]] if df is not None else detail_rows,
+        use_container_width=True,
+        hide_index=True
+    )
+    st.caption(f"Lignes {first + 1 if n_detail else 0}–{last} sur {n_detail:,}".replace(",", " "))
+
+# ---------- Export détaillé (à la demande, par morceaux) ----------
+with st.expander("📥 Export détaillé de la période"):
+    exp_start, exp_end = dstart_l, dend_l
+    st.caption(f"Toutes les lignes du {exp_start} au {exp_end}, relues depuis la base par morceaux.")
+    exp_cols = st.columns([2, 2])
+    with exp_cols[0]:
+        exp_fmt = st.selectbox("Format", available_formats(), key="export_fmt")
+    with exp_cols[1]:
+        st.markdown("<div style='height:28px;'></div>", unsafe_allow_html=True)
+        exp_go = st.button("📦 Préparer l'export", key="export_go")
+
+    # la session ne garde que le chemin du fichier temporaire : il n'est lu qu'au clic sur
+    # « Télécharger » (données différées), supprimé quand un nouvel export le remplace, et balayé
+    # après EXPORT_TTL_S s'il n'est jamais téléchargé
+    sweep_exports()
+
+    def drop_export():
+        ready = st.session_state.pop("export_detail", None)
+        if ready is not None:
+            try:
+                os.unlink(ready[1])
+            except OSError:
+                pass
+
+    # budget d'export : volume de lignes relues (un seul morceau en mémoire à la fois) ; refusé
+    # d'emblée si l'estimation dépasse, interrompu en cours de lecture sinon
+    exp_plan = plan_load(month_rows(), exp_start, exp_end, True, row_bytes().value, EXPORT_BUDGET_MB)
+    exp_key = (exp_start, exp_end, exp_fmt)
+    if exp_go and not exp_plan.unknown and exp_plan.over_budget:
+        st.error(f"Export trop volumineux (~{format_bytes(exp_plan.bytes)} pour un budget de "
+                 f"{format_bytes(exp_plan.budget)}) : réduis la période.")
+    elif exp_go:
+        drop_export()
+        progress = st.empty()
+        try:
+            path, n_rows = export_to_file(
+                iter_data_chunks(exp_start, exp_end, max_bytes=exp_plan.budget),
+                exp_fmt,
+                on_chunk=lambda n: progress.caption(f"⏳ {n:,} lignes écrites…".replace(",", " "))
+            )
+        except BudgetExceeded as over:
+            st.error(f"Export interrompu : plus de {format_bytes(over.used)} relus pour un budget de "
+                     f"{format_bytes(over.budget)}. Réduis la période.")
+        else:
+            st.session_state["export_detail"] = (exp_key, path, n_rows)
+        progress.empty()
+
+    exp_ready = st.session_state.get("export_detail")
+    if exp_ready and exp_ready[0] == exp_key and os.path.exists(exp_ready[1]):
+        ext, mime = EXPORT_FORMATS[exp_fmt][0], EXPORT_FORMATS[exp_fmt][1]
+        st.download_button(
+            label=f"📥 Télécharger ({exp_ready[2]:,} lignes)".replace(",", " "),
+            data=lambda p=exp_ready[1]: read_export(p),
+            file_name=f"matrix_{exp_start}_{exp_end}.{ext}",
+            mime=mime,
+            key="export_dl"
+        )
+    elif exp_ready:
+        drop_export()  # autre période/format : l'ancien fichier n'est plus proposé
+
+# ---------- Panneau performance (admin) + journal JSON ----------
+perf_record = perf.emit()
+perf_history = st.session_state.setdefault("perf_history", [])
+perf_history.append(perf_record)
+del perf_history[:-20]
+
+if email in ADMIN_EMAILS:
+    with st.sidebar.expander("⏱️ Performance (admin)", expanded=False):
+        st.metric("Dernière exécution", f"{perf_record['total_s']:.2f} s")
+        st.dataframe(
+            pd.DataFrame(sorted(perf_record["sections_s"].items(), key=lambda kv: -kv[1]),
+                         columns=["Section", "Secondes"]),
+            hide_index=True, use_container_width=True
+        )
+        st.dataframe(
+            pd.DataFrame(
+                [(fn, calls, calls - misses, misses) for fn, (calls, misses) in perf.cache_stats().items()],
+                columns=["Cache", "Appels", "Hits", "Misses"]
+            ),
+            hide_index=True, use_container_width=True
+        )
+        st.dataframe(
+            pd.DataFrame(sorted(perf_record["counters"].items()), columns=["Compteur", "Valeur"]),
+            hide_index=True, use_container_width=True
+        )
+        if shared_cache() is not None:
+            st.caption("Cache partagé entre réplicas")
+            try:
+                st.json(shared_cache().stats())
+            except Exception as e:
+                st.caption(f"indisponible : {e}")
+        if warmup is not None:
+            st.caption("Préchauffage des caches")
+            st.dataframe(
+                pd.DataFrame([{"Période": k, **v} for k, v in warmup.snapshot().items()]),
+                hide_index=True, use_container_width=True
+            )
+        st.caption("Historique de la session (s)")
+        st.line_chart(pd.DataFrame({"total_s": [r["total_s"] for r in perf_history]}), height=120)
@@ -0,0 +1,116 @@
+# bench_app.py
+# Banc d'essai headless du dashboard (Streamlit AppTest) sur un faux backend Supabase.
+#
+#   python dashboard/bench/bench_app.py --sizes 10000,100000,500000
+#
+# Mesure, pour chaque taille de jeu de données : ouverture à froid (load_filters),
+# chargement à froid / à chaud (load_data + rendu) et la latence de quelques interactions.
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD = os.path.dirname(HERE)
+APP = os.path.join(DASHBOARD, "app.py")
+sys.path.insert(0, DASHBOARD)
+sys.path.insert(0, HERE)
+
+from fake_supabase import FakeClient, FakeUser, generate_matrix, generate_partitions, install  # noqa: E402
+
+ADMIN = "dsi@emova-group.com"
+
+
+def new_session(timeout: float):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    at.session_state["auth"] = {"user": FakeUser(ADMIN), "session": None, "error": None}
+    return at
+
+
+def timed_run(at, client: FakeClient, label: str, results: list, action=None):
+    client.reset_stats()
+    t = time.perf_counter()
+    (action(at) if action else at).run()
+    elapsed = time.perf_counter() - t
+    if at.exception:
+        raise RuntimeError(f"{label} : {at.exception[0].message}")
+    results.append({"etape": label, "secondes": round(elapsed, 3), "requetes": len(client.calls)})
+    return at
+
+
+def bench_size(n_rows: int, n_stores: int, timeout: float) -> list:
+    import streamlit as st
+
+    matrix = generate_matrix(n_rows, n_stores=n_stores)
+    client = FakeClient({"v_matrix": matrix, "matrix_partitions": generate_partitions(matrix)})
+    install(client)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+    results: list = []
+    stores = sorted(client.tables["v_matrix"]["store_name"].unique())
+
+    # --- session 1 : caches vides ---
+    at = new_session(timeout)
+    timed_run(at, client, "ouverture (froid)", results)
+    timed_run(at, client, "chargement (froid)", results, lambda a: a.button(key="load_btn").click())
+
+    # --- session 2 : caches chauds (autre utilisateur, même période) ---
+    at = new_session(timeout)
+    timed_run(at, client, "ouverture (chaud)", results)
+    timed_run(at, client, "chargement (chaud)", results, lambda a: a.button(key="load_btn").click())
+
+    # --- interactions (mode agrégé) ---
+    timed_run(at, client, "granularité Semaine", results, lambda a: a.radio(key="granularity").set_value("Semaine"))
+    timed_run(at, client, "granularité Mois", results, lambda a: a.radio(key="granularity").set_value("Mois"))
+    timed_run(at, client, "top 50 articles", results, lambda a: a.slider(key="topn").set_value(50))
+    timed_run(at, client, "comparaison N-1", results, lambda a: a.toggle(key="yoy").set_value(True))
+    timed_run(at, client, "classement : tri évolution", results,
+              lambda a: a.selectbox(key="lb_sort").set_value("Évolution S/S-1"))
+    timed_run(at, client, "8 semaines + moyennes glissantes", results,
+              lambda a: (a.slider(key="wk_n").set_value(8), a.multiselect(key="wk_baselines").set_value([4, 13]))[-1])
+    timed_run(at, client, "semaines : autre magasin", results, lambda a: a.selectbox(key="wk_store").set_value(stores[0]))
+
+    # --- mode détail (lignes chargées) ---
+    timed_run(at, client, "chargement détail", results,
+              lambda a: (a.toggle(key="detail_mode").set_value(True), a.button(key="load_btn").click())[-1])
+    timed_run(at, client, "détail : tri CA TTC", results, lambda a: a.selectbox(key="detail_sort").set_value("CA TTC"))
+    timed_run(at, client, "détail : page 2", results, lambda a: a.number_input(key="detail_page").set_value(2))
+    timed_run(at, client, "3 magasins + rechargement", results,
+              lambda a: (a.multiselect(key="stores_pick").set_value(stores[:3]), a.button(key="load_btn").click())[-1])
+
+    for r in results:
+        r["lignes"] = n_rows
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai headless du dashboard Matrix")
+    parser.add_argument("--sizes", default="10000,100000,500000", help="tailles de jeu de données (lignes)")
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", help="écrit aussi les résultats dans ce fichier")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SUPABASE_URL", "http://fake.local")
+    os.environ.setdefault("SUPABASE_ANON_KEY", "fake")
+    # pas de préchauffage en arrière-plan : les mesures « à froid » doivent rester à froid
+    os.environ.setdefault("MATRIX_WARMUP", "false")
+
+    all_results = []
+    for size in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        print(f"\n=== {size:,} lignes ===".replace(",", " "))
+        for r in bench_size(size, args.stores, args.timeout):
+            print(f"  {r['etape']:<28} {r['secondes']:>8.3f} s   {r['requetes']:>5} requêtes")
+            all_results.append(r)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench_wire.py
+# Compare le décodage des pages v_matrix : JSON (dicts par ligne) vs CSV (colonnes typées)
+# vs CSV sans libellés (codes + mesures) joint localement à la dimension article.
+#
+#   python dashboard/bench/bench_wire.py --sizes 100000,1000000
+#
+# Les corps de réponse sont générés à l'avance (pages de 1000 lignes, comme PostgREST) :
+# seul le travail côté dashboard est chronométré, du texte reçu au DataFrame typé.
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from fake_supabase import generate_matrix  # noqa: E402
+from wire import ARTICLE_COLS, CSV_ENGINE, article_frame, decode_csv_pages, join_articles, typed_frame  # noqa: E402
+
+PAGE = 1000
+
+
+def json_path(bodies):
+    all_data = []
+    for body in bodies:
+        all_data.extend(json.loads(body))  # ce que fait le client (response.json())
+    return typed_frame(all_data)
+
+
+def csv_path(bodies):
+    return decode_csv_pages(bodies)
+
+
+def codes_path(bodies, dim):
+    return join_articles(decode_csv_pages(bodies), dim, categorical=True)
+
+
+def measure(fn, bodies, trace: bool):
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    t = time.perf_counter()
+    df = fn(bodies)
+    elapsed = time.perf_counter() - t
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak, df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON vs CSV pour les pages v_matrix")
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--trace-memory", action="store_true", help="mesure le pic d'allocation (plus lent)")
+    args = parser.parse_args()
+
+    print(f"moteur CSV : {CSV_ENGINE}")
+    for size in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        src = generate_matrix(size)
+        json_bodies = [src.iloc[i:i + PAGE].to_json(orient="records") for i in range(0, size, PAGE)]
+        csv_bodies = [src.iloc[i:i + PAGE].to_csv(index=False) for i in range(0, size, PAGE)]
+        facts = src.drop(columns=ARTICLE_COLS)
+        codes_bodies = [facts.iloc[i:i + PAGE].to_csv(index=False) for i in range(0, size, PAGE)]
+        dim_rows = src[["code_article"] + ARTICLE_COLS].drop_duplicates("code_article").to_dict("records")
+        dim_bytes = len(json.dumps(dim_rows, separators=(",", ":")))
+        dim = article_frame(dim_rows)
+
+        print(f"\n=== {size:,} lignes ({len(json_bodies)} pages) ===".replace(",", " "))
+        print(f"  charge JSON : {sum(map(len, json_bodies)) / 1e6:8.1f} Mo | "
+              f"charge CSV : {sum(map(len, csv_bodies)) / 1e6:8.1f} Mo | "
+              f"charge codes : {sum(map(len, codes_bodies)) / 1e6:8.1f} Mo "
+              f"(+ dimension {dim_bytes / 1e3:.1f} Ko, une fois par version)")
+        for name, fn, bodies in [("JSON", json_path, json_bodies), ("CSV", csv_path, csv_bodies),
+                                 ("codes", lambda b: codes_path(b, dim), codes_bodies)]:
+            elapsed, peak, df = measure(fn, bodies, args.trace_memory)
+            mem = df.memory_usage(deep=True).sum() / 1e6
+            line = f"  {name:<5} {elapsed:8.3f} s | DataFrame {mem:8.1f} Mo"
+            if args.trace_memory:
+                line += f" | pic alloc {peak / 1e6:8.1f} Mo"
+            print(line)
+            del df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# check_sharedcache.py
+# Vérifie le cache partagé entre réplicas sur un volume de fichiers : deux « réplicas » (deux
+# instances FileCache sur le même dossier) se partagent un chargement, le DataFrame relu est
+# identique (catégories comprises) et la taille reste sous la borne après éviction.
+#
+#   python dashboard/bench/check_sharedcache.py --rows 200000 --max-mb 20
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import pandas as pd  # noqa: E402
+
+from fake_supabase import generate_matrix  # noqa: E402
+from sharedcache import FileCache, cache_key  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test du cache partagé (fichiers Arrow)")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--max-mb", type=float, default=20)
+    parser.add_argument("--entries", type=int, default=12, help="périodes écrites pour forcer l'éviction")
+    args = parser.parse_args()
+
+    df = generate_matrix(args.rows)
+    df["period_date"] = pd.to_datetime(df["period_date"])
+    df["libelle_final"] = df["libelle_final"].astype("category")
+    max_bytes = int(args.max_mb * 1024 ** 2)
+
+    with tempfile.TemporaryDirectory() as root:
+        replica_a, replica_b = FileCache(root, max_bytes), FileCache(root, max_bytes)
+        key = cache_key("load_data", "2024-01-01", "2024-12-31", "v1")
+
+        t = time.perf_counter()
+        replica_a.put_frame(key, df)
+        t_put = time.perf_counter() - t
+        t = time.perf_counter()
+        back = replica_b.get_frame(key)
+        t_get = time.perf_counter() - t
+        same = back is not None and back.equals(df) and str(back["libelle_final"].dtype) == "category"
+        print(f"écriture {t_put:.3f} s | relecture autre réplica {t_get:.3f} s | identique={same}")
+
+        for i in range(args.entries):
+            replica_a.put_frame(cache_key("load_data", i), df.sample(frac=0.3, random_state=i))
+        stats = replica_b.stats()
+        bounded = stats["octets"] <= max_bytes
+        print(f"après {args.entries} écritures : {stats['entrées']} entrées, "
+              f"{stats['octets'] / 1024 ** 2:.1f} Mo (borne {args.max_mb} Mo)")
+
+    ok = same and bounded
+    print("OK ✅" if ok else "ÉCHEC ❌")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# check_singleflight.py
+# Vérifie que N sessions qui cliquent « Charger » en même temps sur des périodes qui se recouvrent
+# ne téléchargent chaque mois du snapshot DuckDB qu'une fois. Les sessions exécutent le vrai app.py
+# (Streamlit AppTest, faux backend Supabase, MATRIX_ENGINE=duckdb) : sync_snapshot et son
+# single-flight par mois sont ceux qui sont livrés.
+# Les chargements sous st.cache_data (load_data, rpc_aggregate…) ne passent pas par le single-flight :
+# Streamlit y tient déjà un verrou de calcul par clé.
+#
+#   python dashboard/bench/check_singleflight.py --sessions 12
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from datetime import date
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from bench_app import new_session  # noqa: E402
+from fake_supabase import FakeClient, generate_matrix, generate_partitions, install  # noqa: E402
+
+# périodes décalées d'un mois : chaque mois intérieur est demandé par plusieurs sessions
+RANGES = [(date(2024, 1, 10), date(2024, 3, 20)), (date(2024, 2, 5), date(2024, 4, 25)),
+          (date(2024, 3, 1), date(2024, 5, 31))]
+
+
+def serialize_script_compile():
+    """Chaque exécution AppTest compile app.py avec son propre ScriptCache ; sous CPython 3.11, des
+    compilations simultanées peuvent lever « SystemError: AST constructor recursion depth mismatch »
+    et la session s'arrête sans rien afficher. Les compilations passent une à une, les chargements
+    restent simultanés."""
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    lock, get_bytecode = threading.Lock(), ScriptCache.get_bytecode
+
+    def locked(self, script_path):
+        with lock:
+            return get_bytecode(self, script_path)
+
+    ScriptCache.get_bytecode = locked
+
+
+class RunLog(logging.Handler):
+    """Récupère les mesures JSON émises par perf.py à chaque exécution du script."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(json.loads(record.getMessage()))
+
+    def total(self, counter: str) -> int:
+        return sum(r["counters"].get(counter, 0) for r in self.records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de concurrence du single-flight (app.py réel)")
+    parser.add_argument("--sessions", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.005, help="délai simulé par requête (s)")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    snapshot_dir = tempfile.mkdtemp(prefix="matrix_snapshot_check_")
+    os.environ.update(MATRIX_ENGINE="duckdb", MATRIX_SNAPSHOT_DIR=snapshot_dir)
+    os.environ.setdefault("SUPABASE_URL", "http://fake.local")
+    os.environ.setdefault("SUPABASE_ANON_KEY", "fake")
+    os.environ.setdefault("MATRIX_WARMUP", "false")
+
+    # ~6 mois de données, 4 magasins × 10 lignes par jour
+    matrix = generate_matrix(7300, n_stores=4, n_articles=40)
+    client = FakeClient({"v_matrix": matrix, "matrix_partitions": generate_partitions(matrix)}, latency=args.latency)
+    install(client)
+
+    import streamlit as st
+    from snapshot import read_manifest
+    serialize_script_compile()
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+    # ouverture de chaque session (filtres, versions) et choix de sa période avant le clic simultané
+    sessions = [new_session(args.timeout) for _ in range(args.sessions)]
+    for i, at in enumerate(sessions):
+        at.run()
+        at.date_input[0].set_value(RANGES[i % len(RANGES)])
+        at.run()
+    client.reset_stats()
+
+    log = RunLog()
+    logging.getLogger("matrix.perf").addHandler(log)
+    barrier = threading.Barrier(args.sessions)
+    errors = []
+
+    def click(at):
+        barrier.wait()
+        at.button(key="load_btn").click().run()
+        if at.exception:
+            errors.append(at.exception[0].message)
+
+    threads = [threading.Thread(target=click, args=(at,)) for at in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # après l'ouverture, seule la synchronisation du snapshot lit v_matrix : un parcours par mois
+    scans = sum(1 for table, _, rng in client.calls if table == "v_matrix" and rng is not None and rng[0] == 0)
+    months = sorted(read_manifest(snapshot_dir))
+    shared = log.total("singleflight.shared.snapshot_sync")
+    print(f"sessions={args.sessions} | mois synchronisés={len(months)} ({months[0]} → {months[-1]}) | "
+          f"parcours v_matrix={scans} | partagés single-flight={shared} | requêtes={len(client.calls)}")
+    for e in errors:
+        print(f"  erreur : {e}")
+    ok = not errors and months and scans == len(months) and shared > 0
+    print("OK ✅" if ok else "ÉCHEC ❌")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# fake_supabase.py
+# Faux client Supabase en mémoire pour le banc d'essai : reproduit le sous-ensemble du
+# query builder PostgREST utilisé par le dashboard (select/neq/gte/lte/order/limit/range/execute)
+# et les fonctions RPC d'agrégats.
+import sys
+import time
+import types
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+FAMILLES = ["FLEURS COUPEES", "PLANTES", "BOUQUETS", "ACCESSOIRES", "DECORATION", "TERREAU", "CARTES", "DIVERS"]
+
+
+def generate_matrix(n_rows: int, n_stores: int = 20, start: str = "2024-01-01",
+                    n_articles: int = 400, seed: int = 42) -> pd.DataFrame:
+    """Lignes synthétiques au format de v_matrix (magasin × jour × articles vendus)."""
+    rng = np.random.default_rng(seed)
+    stores = [f"MAGASIN{i:04d}" for i in range(n_stores)]
+    per_day = max(1, n_articles // 4)
+    n_days = max(1, -(-n_rows // (n_stores * per_day)))
+    days = pd.date_range(start, periods=n_days, freq="D")
+
+    store_idx = np.repeat(np.arange(n_stores), n_days * per_day)[:n_rows]
+    day_idx = np.tile(np.repeat(np.arange(n_days), per_day), n_stores)[:n_rows]
+    art_idx = rng.integers(0, n_articles, size=n_rows)
+
+    qte = rng.integers(1, 12, size=n_rows)
+    prix = np.round(rng.uniform(1.5, 45.0, size=n_articles), 2)[art_idx]
+    ventes_ttc = np.round(qte * prix, 2)
+    ventes_ht = np.round(ventes_ttc / 1.2, 2)
+    marge_ht = np.round(ventes_ht * rng.uniform(0.2, 0.6, size=n_rows), 2)
+
+    return pd.DataFrame({
+        "store_name": np.array(stores)[store_idx],
+        "period_date": days[day_idx].strftime("%Y-%m-%d"),
+        "code_article": np.char.add("ART", np.char.zfill(art_idx.astype(str), 5)),
+        "libelle_final": np.char.add("Article ", art_idx.astype(str)),
+        "famille_finale": np.array(FAMILLES)[art_idx % len(FAMILLES)],
+        "qte": qte,
+        "ventes_ht": ventes_ht,
+        "ventes_ttc": ventes_ttc,
+        "marge_ht": marge_ht,
+        "marge_pct": np.round(marge_ht / ventes_ht * 100, 2),
+    })
+
+
+def generate_partitions(matrix: pd.DataFrame) -> pd.DataFrame:
+    """Table matrix_partitions correspondant à un jeu v_matrix (version 1 partout)."""
+    parts = (matrix.assign(month=matrix["period_date"].str[:7] + "-01")
+             .groupby(["store_name", "month"], as_index=False).size()
+             .rename(columns={"size": "row_count"}))
+    return parts.assign(version=1, updated_at="2025-01-01T00:00:00+00:00")
+
+
+@dataclass
+class FakeResponse:
+    data: Any
+    count: Optional[int] = None
+
+
+class FakeQuery:
+    def __init__(self, backend: "FakeClient", table: str):
+        self.backend = backend
+        self.table = table
+        self.columns: Optional[List[str]] = None
+        self.filters: list = []
+        self.orders: list = []
+        self._limit: Optional[int] = None
+        self._range: Optional[tuple] = None
+        self._csv = False
+
+    def _clone(self) -> "FakeQuery":
+        q = FakeQuery(self.backend, self.table)
+        q.columns, q.filters, q.orders = self.columns, list(self.filters), list(self.orders)
+        q._limit, q._range, q._csv = self._limit, self._range, self._csv
+        return q
+
+    # --- construction (chaque appel renvoie une copie, comme le builder réel est réutilisé) ---
+    def select(self, columns: str = "*", **_):
+        q = self._clone()
+        q.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return q
+
+    def _filter(self, op, col, value):
+        q = self._clone()
+        q.filters.append((op, col, value))
+        return q
+
+    def eq(self, col, value):
+        return self._filter("eq", col, value)
+
+    def neq(self, col, value):
+        return self._filter("neq", col, value)
+
+    def gte(self, col, value):
+        return self._filter("gte", col, value)
+
+    def lte(self, col, value):
+        return self._filter("lte", col, value)
+
+    def in_(self, col, values):
+        return self._filter("in", col, list(values))
+
+    def order(self, col, desc: bool = False, **_):
+        q = self._clone()
+        q.orders.append((col, desc))
+        return q
+
+    def limit(self, n: int):
+        q = self._clone()
+        q._limit = n
+        return q
+
+    def range(self, start: int, end: int):
+        q = self._clone()
+        q._range = (start, end)
+        return q
+
+    def csv(self):
+        # Accept: text/csv -> la réponse est une chaîne CSV (en-tête compris)
+        q = self._clone()
+        q._csv = True
+        return q
+
+    # --- exécution ---
+    def _frame(self) -> pd.DataFrame:
+        # le résultat filtré/trié est mis en cache par signature : la pagination ne retrie pas
+        sig = (self.table, tuple(self.columns or ()), tuple((o, c, str(v)) for o, c, v in self.filters),
+               tuple(self.orders))
+        cached = self.backend._results.get(sig)
+        if cached is not None:
+            return cached
+        df = self.backend.tables[self.table]
+        for op, col, value in self.filters:
+            if op == "eq":
+                df = df[df[col] == value]
+            elif op == "neq":
+                df = df[df[col] != value]
+            elif op == "gte":
+                df = df[df[col] >= value]
+            elif op == "lte":
+                df = df[df[col] <= value]
+            elif op == "in":
+                df = df[df[col].isin(value)]
+        if self.orders:
+            df = df.sort_values([c for c, _ in self.orders],
+                                ascending=[not d for _, d in self.orders], kind="mergesort")
+        if self.columns:
+            df = df[self.columns]
+        df = df.reset_index(drop=True)
+        self.backend._results[sig] = df
+        return df
+
+    def _window(self) -> pd.DataFrame:
+        df = self._frame()
+        if self._range is not None:
+            df = df.iloc[self._range[0]: self._range[1] + 1]
+        if self._limit is not None:
+            df = df.iloc[: self._limit]
+        return df
+
+    def execute(self) -> FakeResponse:
+        self.backend.calls.append((self.table, "execute", self._range))
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        window = self._window()
+        if self._csv:
+            return FakeResponse(window.to_csv(index=False))
+        return FakeResponse(window.to_dict("records"))
+
+
+class FakeRpc:
+    """Fonctions de sql/matrix_aggregates.sql rejouées en pandas sur v_matrix."""
+
+    def __init__(self, backend: "FakeClient", fn: str, params: dict):
+        self.backend, self.fn, self.params = backend, fn, params
+        self._range: Optional[tuple] = None
+
+    def range(self, start: int, end: int):
+        self._range = (start, end)
+        return self
+
+    def execute(self) -> FakeResponse:
+        self.backend.calls.append(("rpc", self.fn, self._range))
+        out = self._result()
+        if self._range is not None:
+            out = out.iloc[self._range[0]: self._range[1] + 1]
+        return FakeResponse(out.to_dict("records"))
+
+    def _result(self) -> pd.DataFrame:
+        from aggregates import GRANULARITIES, FrameAggregates
+
+        p = self.params
+        df = self.backend.tables["v_matrix"]
+        if self.fn == "matrix_articles":
+            return (df[["code_article", "libelle_final", "famille_finale"]]
+                    .drop_duplicates("code_article").sort_values("code_article"))
+        df = df[(df["period_date"] >= p["p_start"]) & (df["period_date"] <= p["p_end"])]
+        df = df.assign(period_date=pd.to_datetime(df["period_date"]))
+        agg, stores = FrameAggregates(df), p.get("p_stores")
+        if self.fn == "matrix_kpis":
+            out = pd.DataFrame([agg.kpis(stores)])
+        elif self.fn == "matrix_series":
+            gran = {v: k for k, v in GRANULARITIES.items()}[p["p_granularity"]]
+            out = agg.series(gran, stores, p.get("p_by_store", True))
+            out["bucket"] = out["bucket"].dt.strftime("%Y-%m-%d")
+        elif self.fn == "matrix_familles":
+            out = agg.familles(stores)
+        elif self.fn == "matrix_top_articles":
+            out = agg.top_articles(p.get("p_limit", 15), stores)
+        elif self.fn == "matrix_daily":
+            out = agg.daily(stores, p.get("p_by_store", False))
+            out["period_date"] = out["period_date"].dt.strftime("%Y-%m-%d")
+        elif self.fn == "matrix_store_weeks":
+            out = agg.store_weeks(stores)
+        elif self.fn == "matrix_dow_week":
+            out = agg.dow_week(stores, p.get("p_by_store", False))
+        else:
+            raise ValueError(f"fonction RPC inconnue : {self.fn}")
+        return out.reset_index(drop=True)
+
+
+class FakeClient:
+    def __init__(self, tables: dict, latency: float = 0.0):
+        self.tables = tables
+        self.latency = latency  # délai simulé par requête (s)
+        self.calls: list = []
+        self._results: dict = {}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None) -> FakeRpc:
+        return FakeRpc(self, fn, params or {})
+
+    def reset_stats(self):
+        self.calls.clear()
+
+
+@dataclass
+class FakeUser:
+    email: str
+    id: str = "00000000-0000-0000-0000-000000000000"
+
+
+def install(client: FakeClient):
+    """Remplace le module `supabase` par un module factice dont create_client renvoie `client`."""
+    mod = types.ModuleType("supabase")
+    mod.Client = FakeClient
+    mod.create_client = lambda *_args, **_kwargs: client
+    sys.modules["supabase"] = mod
+    return mod
@@ -0,0 +1,76 @@
+# charts.py
+# Réduction de la charge envoyée au navigateur par les graphiques Altair :
+# chaque graphique embarque ses données dans la spec Vega.
+import json
+
+import numpy as np
+import pandas as pd
+
+POINTS_PER_SERIES = 180   # au-delà, une série journalière est sous-échantillonnée (LTTB)
+TOP_K_STORES = 10
+TOP_K_FAMILIES = 12
+AUTRES = "Autres"
+
+
+def lttb(df_in: pd.DataFrame, x: str, y: str, n_out: int) -> pd.DataFrame:
+    """Largest-Triangle-Three-Buckets : garde n_out points en préservant la forme de la série."""
+    n = len(df_in)
+    if n_out >= n or n_out < 3:
+        return df_in
+    d = df_in.sort_values(x)
+    col = d[x]
+    if pd.api.types.is_numeric_dtype(col):
+        xs = col.to_numpy(dtype=float)
+    else:
+        xs = pd.to_datetime(col).astype("int64").to_numpy(dtype=float)
+    ys = d[y].to_numpy(dtype=float)
+    ys = np.where(np.isnan(ys), 0.0, ys)
+
+    keep = [0]
+    every = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        lo = int(np.floor(i * every)) + 1
+        hi = int(np.floor((i + 1) * every)) + 1
+        nxt_lo, nxt_hi = hi, min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x, avg_y = xs[nxt_lo:nxt_hi].mean(), ys[nxt_lo:nxt_hi].mean()
+        area = np.abs((xs[a] - avg_x) * (ys[lo:hi] - ys[a]) - (xs[a] - xs[lo:hi]) * (avg_y - ys[a]))
+        a = lo + int(area.argmax())
+        keep.append(a)
+    keep.append(n - 1)
+    return d.iloc[keep]
+
+
+def downsample_series(df_in: pd.DataFrame, x: str, y: str, n_out: int = POINTS_PER_SERIES) -> pd.DataFrame:
+    """Sous-échantillonne toutes les séries sur les mêmes abscisses : LTTB choisit les points
+    sur la série totale (somme de `y` par `x`), chaque série garde ces abscisses-là."""
+    total = df_in.groupby(x, as_index=False)[y].sum()
+    if len(total) <= n_out:
+        return df_in
+    kept = lttb(total, x, y, n_out)[x]
+    return df_in[df_in[x].isin(kept)]
+
+
+def top_k_with_other(df_in: pd.DataFrame, key: str, value: str, k: int, sum_cols=None, other_label: str = AUTRES) -> pd.DataFrame:
+    """Garde les k clés au plus fort total de `value` et regroupe le reste sous `other_label`."""
+    totals = df_in.groupby(key)[value].sum().sort_values(ascending=False)
+    if len(totals) <= k:
+        return df_in
+    keep = set(totals.index[:k])
+    out = df_in.copy()
+    out[key] = out[key].where(out[key].isin(keep), other_label)
+    group_cols = [c for c in out.columns if c not in (sum_cols or [value])]
+    return out.groupby(group_cols, as_index=False, sort=False)[sum_cols or [value]].sum()
+
+
+def payload_bytes(chart) -> int:
+    """Taille de la spec Vega-Lite (données embarquées comprises) envoyée au navigateur."""
+    return len(json.dumps(chart.to_dict(), separators=(",", ":")).encode("utf-8"))
+
+
+def format_bytes(n: int) -> str:
+    if n < 1024:
+        return f"{n} o"
+    if n < 1024 ** 2:
+        return f"{n / 1024:.1f} Ko".replace(".", ",")
+    return f"{n / 1024 ** 2:.1f} Mo".replace(".", ",")
@@ -0,0 +1,142 @@
+# exports.py
+# Écriture des exports détaillés par morceaux (CSV / XLSX / Parquet) dans un fichier
+# temporaire : on ne garde jamais en mémoire qu'un morceau de lignes à la fois.
+# Les fichiers jamais téléchargés (session fermée, export abandonné) sont balayés après EXPORT_TTL_S.
+import io
+import os
+import tempfile
+import threading
+import time
+import importlib.util
+from typing import Callable, Iterable, Optional
+
+import pandas as pd
+
+XLSX_MAX_ROWS = 1_048_575  # limite Excel (hors ligne d'en-tête)
+EXPORT_PREFIX = "matrix_export_"
+EXPORT_TTL_S = float(os.environ.get("MATRIX_EXPORT_TTL_S", "3600"))
+SWEEP_EVERY_S = 300
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def write_csv(chunks: Iterable[pd.DataFrame], fh) -> int:
+    n = 0
+    text = io.TextIOWrapper(fh, encoding="utf-8", newline="")
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(text, index=False, sep=";", header=(i == 0))
+        n += len(chunk)
+    text.flush()
+    text.detach()
+    return n
+
+
+def write_xlsx(chunks: Iterable[pd.DataFrame], fh) -> int:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws, ws_rows, sheet_no, n = None, 0, 0, 0
+    for chunk in chunks:
+        # les dates sont écrites en texte ISO pour rester lisibles dans Excel
+        chunk = chunk.copy()
+        for c in chunk.select_dtypes(include=["datetime64[ns]"]).columns:
+            chunk[c] = chunk[c].dt.strftime("%Y-%m-%d")
+        for row in chunk.itertuples(index=False, name=None):
+            if ws is None or ws_rows >= XLSX_MAX_ROWS:
+                sheet_no += 1
+                ws = wb.create_sheet(title=f"lignes_{sheet_no}")
+                ws.append(list(chunk.columns))
+                ws_rows = 0
+            ws.append([None if pd.isna(v) else v for v in row])
+            ws_rows += 1
+            n += 1
+    if ws is None:
+        wb.create_sheet(title="lignes_1")
+    wb.save(fh)
+    return n
+
+
+def write_parquet(chunks: Iterable[pd.DataFrame], fh) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer, n = None, 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(fh, table.schema, compression="snappy")
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)  # un row group par morceau
+            n += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n
+
+
+# format -> (extension, mime, module requis, écrivain)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv", None, write_csv),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "openpyxl", write_xlsx),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", "pyarrow", write_parquet),
+}
+
+
+def available_formats() -> list:
+    return [f for f, (_, _, mod, _) in EXPORT_FORMATS.items()
+            if mod is None or importlib.util.find_spec(mod) is not None]
+
+
+def export_to_file(chunks: Iterable[pd.DataFrame], fmt: str,
+                   on_chunk: Optional[Callable[[int], None]] = None) -> tuple:
+    """Écrit les morceaux dans un fichier temporaire et renvoie (chemin, nb lignes)."""
+    ext, _, _, writer = EXPORT_FORMATS[fmt]
+
+    def _counted(it):
+        total = 0
+        for chunk in it:
+            total += len(chunk)
+            if on_chunk:
+                on_chunk(total)
+            yield chunk
+
+    fd, path = tempfile.mkstemp(prefix=EXPORT_PREFIX, suffix=f".{ext}")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            n = writer(_counted(chunks), fh)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, n
+
+
+def read_export(path: str) -> bytes:
+    """Contenu d'un export, lu au moment du clic sur « Télécharger » (données différées)."""
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def sweep_exports(max_age_s: float = EXPORT_TTL_S, force: bool = False) -> int:
+    """Supprime les exports temporaires plus vieux que max_age_s ; au plus une passe toutes les
+    SWEEP_EVERY_S secondes par processus (sauf force). Renvoie le nombre de fichiers supprimés."""
+    global _last_sweep
+    now = time.time()
+    with _sweep_lock:
+        if not force and now - _last_sweep < SWEEP_EVERY_S:
+            return 0
+        _last_sweep = now
+    removed = 0
+    with os.scandir(tempfile.gettempdir()) as it:
+        for e in it:
+            if not e.name.startswith(EXPORT_PREFIX):
+                continue
+            try:
+                if now - e.stat().st_mtime > max_age_s:
+                    os.unlink(e.path)
+                    removed += 1
+            except OSError:
+                pass  # déjà supprimé par une autre session
+    return removed
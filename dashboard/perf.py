@@ -0,0 +1,107 @@
+# perf.py
+# Instrumentation du chemin critique du dashboard : temps par section, lignes/octets/pages
+# récupérés, hits/misses de cache. Une mesure par exécution du script, journalisée en JSON.
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("matrix.perf")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_local = threading.local()
+
+
+class PerfRun:
+    def __init__(self, session_id: str = "", user: str = ""):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.user = user
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.sections = {}   # nom -> secondes (cumulées)
+        self.counters = {}   # nom -> entier
+        self._open = None    # (nom, début) de la section "au fil du script"
+
+    @contextmanager
+    def section(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.sections[name] = self.sections.get(name, 0.0) + time.perf_counter() - t
+
+    def start(self, name: str):
+        """Ferme la section en cours et en ouvre une nouvelle (script linéaire, sans indentation)."""
+        self.stop()
+        self._open = (name, time.perf_counter())
+
+    def stop(self):
+        if self._open is not None:
+            name, t = self._open
+            self.sections[name] = self.sections.get(name, 0.0) + time.perf_counter() - t
+            self._open = None
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def cache_stats(self) -> dict:
+        """{fonction: (appels, misses)} ; un miss est compté dans le corps de la fonction en cache."""
+        out = {}
+        for k, v in self.counters.items():
+            if k.startswith("cache_call."):
+                fn = k[len("cache_call."):]
+                out[fn] = (v, self.counters.get(f"cache_miss.{fn}", 0))
+        return out
+
+    def to_dict(self) -> dict:
+        return {
+            "event": "dashboard_run",
+            "run_id": self.run_id,
+            "session_id": self.session_id,
+            "user": self.user,
+            "ts": round(self.started, 3),
+            "total_s": round(time.perf_counter() - self.t0, 4),
+            "sections_s": {k: round(v, 4) for k, v in self.sections.items()},
+            "counters": dict(self.counters),
+        }
+
+    def emit(self) -> dict:
+        self.stop()
+        record = self.to_dict()
+        logger.info(json.dumps(record, ensure_ascii=False))
+        return record
+
+
+def new_run(session_id: str = "", user: str = "") -> PerfRun:
+    run = PerfRun(session_id, user)
+    _local.run = run
+    return run
+
+
+def current_run() -> PerfRun:
+    # hors exécution du script (thread de fond, etc.) : mesure jetable
+    run = getattr(_local, "run", None)
+    if run is None:
+        run = PerfRun()
+        _local.run = run
+    return run
+
+
+def cached_call(name: str, fn, *args, **kwargs):
+    """Appelle une fonction @st.cache_data en chronométrant l'appel et en comptant les hits/misses."""
+    run = current_run()
+    run.count(f"cache_call.{name}")
+    with run.section(name):
+        return fn(*args, **kwargs)
+
+
+def mark_miss(name: str):
+    current_run().count(f"cache_miss.{name}")
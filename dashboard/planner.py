@@ -0,0 +1,109 @@
+# planner.py
+# Planificateur de chargement : avant tout fetch de lignes, estime le volume d'une période à partir
+# des statistiques de partitions (matrix_partitions.row_count, magasin × mois) et choisit :
+#   - "detail"   : chargement complet des lignes, l'estimation tient dans le budget de session ;
+#   - "agregats" : indicateurs calculés par la base / le snapshot, aucune ligne en mémoire ;
+#   - "reduit"   : agrégats sur toute la période, détail des lignes sur la fin de période qui tient.
+# Un mois sans statistique (absent ou row_count inconnu) rend l'estimation inconnue : la période est
+# traitée comme hors budget, jamais comme vide. Le chargement lui-même reste borné (BudgetExceeded).
+import os
+import threading
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+import pandas as pd
+
+SESSION_BUDGET_MB = float(os.environ.get("MATRIX_SESSION_BUDGET_MB", "512"))
+EXPORT_BUDGET_MB = float(os.environ.get("MATRIX_EXPORT_BUDGET_MB", "4096"))  # lignes relues par un export
+ROW_BYTES = float(os.environ.get("MATRIX_ROW_BYTES", "220"))  # octets en mémoire par ligne (avant calibrage)
+
+
+@dataclass
+class LoadPlan:
+    rows: Optional[int]          # None : statistiques indisponibles
+    bytes: Optional[int]
+    budget: int
+    strategy: str                # "detail" | "agregats" | "reduit"
+    narrowed_start: Optional[date] = None
+
+    @property
+    def unknown(self) -> bool:
+        return self.bytes is None
+
+    @property
+    def over_budget(self) -> bool:
+        # volume inconnu : rien ne garantit qu'il tienne
+        return self.unknown or self.bytes > self.budget
+
+
+class BudgetExceeded(RuntimeError):
+    """Lignes décodées au-delà du budget : le chargement est interrompu avant d'être conservé."""
+
+    def __init__(self, used: int, budget: int):
+        super().__init__(f"{used} octets décodés, budget {budget}")
+        self.used = used
+        self.budget = budget
+
+
+class RowBytes:
+    """Octets par ligne, recalés (moyenne glissante) sur la mémoire réelle des chargements."""
+
+    def __init__(self, initial: float = ROW_BYTES, alpha: float = 0.3):
+        self.value = initial
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def observe(self, n_rows: int, n_bytes: int):
+        if n_rows > 0:
+            with self._lock:
+                self.value = (1 - self.alpha) * self.value + self.alpha * (n_bytes / n_rows)
+
+
+def estimate_rows(month_rows: pd.Series, dstart: date, dend: date) -> Optional[float]:
+    """Lignes estimées : `month_rows` ({"YYYY-MM": lignes}) au prorata des jours couverts par mois ;
+    None si un mois de la période n'a pas de statistique."""
+    total = 0.0
+    for p in pd.period_range(dstart, dend, freq="M"):
+        n = month_rows.get(p.strftime("%Y-%m"))
+        if n is None or pd.isna(n):
+            return None
+        a, b = max(dstart, p.start_time.date()), min(dend, p.end_time.date())
+        total += float(n) * ((b - a).days + 1) / p.days_in_month
+    return total
+
+
+def fit_start(month_rows: pd.Series, dstart: date, dend: date, max_rows: float) -> Optional[date]:
+    """Début le plus tôt (>= dstart) tel que [début, dend] tienne dans max_rows ; None si même un jour déborde."""
+    def fits(start: date) -> bool:
+        rows = estimate_rows(month_rows, start, dend)
+        return rows is not None and rows <= max_rows
+
+    lo, hi = 0, (dend - dstart).days  # décalage en jours depuis dstart ; l'estimation décroît avec lui
+    if not fits(dend):
+        return None
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if fits(dstart + timedelta(days=mid)):
+            hi = mid
+        else:
+            lo = mid + 1
+    return dstart + timedelta(days=lo)
+
+
+def plan_load(month_rows: Optional[pd.Series], dstart: date, dend: date, detail: bool,
+              row_bytes: float, budget_mb: float = SESSION_BUDGET_MB) -> LoadPlan:
+    budget = int(budget_mb * 1024 ** 2)
+    rows = estimate_rows(month_rows, dstart, dend) if month_rows is not None else None
+    if rows is None:
+        plan = LoadPlan(None, None, budget, "agregats")
+    else:
+        plan = LoadPlan(int(rows), int(rows * row_bytes), budget, "agregats")
+    if not detail:
+        return plan
+    if not plan.over_budget:
+        plan.strategy = "detail"
+        return plan
+    if month_rows is not None:
+        plan.narrowed_start = fit_start(month_rows, dstart, dend, budget / row_bytes)
+    return plan
@@ -0,0 +1,227 @@
+# sharedcache.py
+# Cache partagé entre réplicas du dashboard (optionnel), consulté quand st.cache_data rate :
+# une période déjà chargée par un autre processus est relue au lieu d'être refetchée, et une
+# nouvelle réplica démarre chaude. Deux supports, choisis par MATRIX_SHARED_CACHE :
+#   - file:///chemin ou /chemin : fichiers Arrow IPC (format fichier) sur un volume partagé, lus en
+#                                  mémoire mappée : la seule copie est la conversion vers pandas ;
+#   - redis://…                  : store compatible Redis (DataFrames en fichiers Arrow IPC).
+# Taille bornée (MATRIX_SHARED_CACHE_MAX_MB) : les entrées les moins récemment lues sont évincées.
+import abc
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+import pandas as pd
+
+logger = logging.getLogger("matrix.sharedcache")
+
+REDIS_TIMEOUT_S = float(os.environ.get("MATRIX_SHARED_CACHE_TIMEOUT_S", "2"))
+
+
+def cache_key(name: str, *parts) -> str:
+    raw = json.dumps([name, *parts], default=str, sort_keys=True, separators=(",", ":"))
+    return f"{name}-{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _frame_to_ipc(df: pd.DataFrame) -> bytes:
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _frame_from_ipc(data) -> pd.DataFrame:
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.BufferReader(data)).read_all().to_pandas()
+
+
+class SharedCache(abc.ABC):
+    """Interface commune : octets bruts (_get/_put) + DataFrames (Arrow) et objets JSON."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    def _put(self, key: str, data: bytes):
+        ...
+
+    @abc.abstractmethod
+    def stats(self) -> dict:
+        ...
+
+    def get_frame(self, key: str) -> Optional[pd.DataFrame]:
+        data = self._get(key + ".arrow")
+        return None if data is None else _frame_from_ipc(data)
+
+    def put_frame(self, key: str, df: pd.DataFrame):
+        self._put(key + ".arrow", _frame_to_ipc(df))
+
+    def get_json(self, key: str) -> Any:
+        data = self._get(key + ".json")
+        return None if data is None else json.loads(data)
+
+    def put_json(self, key: str, value: Any):
+        self._put(key + ".json", json.dumps(value, separators=(",", ":"), default=str).encode("utf-8"))
+
+
+class FileCache(SharedCache):
+    """Fichiers sur un volume partagé ; la date de modification sert de date de dernier accès."""
+
+    def __init__(self, root: str, max_bytes: int):
+        super().__init__(max_bytes)
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path)
+        except OSError:
+            return False  # absent (ou évincé par une autre réplica entre-temps)
+        return True
+
+    def _get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not self._touch(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get_frame(self, key: str) -> Optional[pd.DataFrame]:
+        import pyarrow as pa
+
+        path = self._path(key + ".arrow")
+        if not self._touch(path):
+            return None
+        try:
+            with pa.memory_map(path, "r") as src:
+                # format fichier : les colonnes pointent dans la projection, to_pandas est la seule copie
+                return pa.ipc.open_file(src).read_all().to_pandas()
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+    def _put(self, key: str, data: bytes):
+        path = self._path(key)
+        tmp = f"{path}.tmp_{os.getpid()}_{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # remplacement atomique : un lecteur voit l'ancienne ou la nouvelle version
+        self._evict()
+
+    def _entries(self) -> list:
+        out = []
+        with os.scandir(self.root) as it:
+            for e in it:
+                if e.is_file() and ".tmp_" not in e.name:
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    out.append((st.st_mtime, st.st_size, e.path))
+        return out
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {"support": f"fichiers ({self.root})", "entrées": len(entries),
+                "octets": sum(size for _, size, _ in entries), "max_octets": self.max_bytes}
+
+
+# Écriture + comptabilité des tailles + éviction en un seul script : atomique côté serveur,
+# deux réplicas qui écrivent en même temps ne faussent pas le total.
+# KEYS : ensemble trié (dernier accès), hash (tailles), total ; ARGV : préfixe, clé, données, date, borne
+_REDIS_PUT = """
+local key = ARGV[2]
+local size = string.len(ARGV[3])
+local old = tonumber(redis.call('HGET', KEYS[2], key) or '0')
+redis.call('SET', ARGV[1] .. key, ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[4], key)
+redis.call('HSET', KEYS[2], key, size)
+local total = redis.call('INCRBY', KEYS[3], size - old)
+local max = tonumber(ARGV[5])
+while total > max do
+    local oldest = redis.call('ZPOPMIN', KEYS[1])
+    if #oldest == 0 then break end
+    local victim = oldest[1]
+    local vsize = tonumber(redis.call('HGET', KEYS[2], victim) or '0')
+    redis.call('DEL', ARGV[1] .. victim)
+    redis.call('HDEL', KEYS[2], victim)
+    total = redis.call('DECRBY', KEYS[3], vsize)
+end
+return total
+"""
+
+
+class RedisCache(SharedCache):
+    """Store compatible Redis ; un ensemble trié (dernier accès) et un hash (tailles) pilotent l'éviction."""
+
+    def __init__(self, url: str, max_bytes: int, prefix: str = "matrix:", timeout: float = REDIS_TIMEOUT_S):
+        super().__init__(max_bytes)
+        import redis
+
+        # délais bornés : un store injoignable fait échouer l'appel (repli sur le chargement normal)
+        # au lieu de bloquer le script
+        self.r = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.r.ping()  # échoue ici si le store est absent : from_env désactive alors le cache partagé
+        self.prefix = prefix
+        self._lru, self._sizes, self._total = prefix + "_lru", prefix + "_sizes", prefix + "_total"
+        self._put_script = self.r.register_script(_REDIS_PUT)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        data = self.r.get(self.prefix + key)
+        if data is not None:
+            self.r.zadd(self._lru, {key: time.time()}, xx=True)  # xx : ne recrée pas une entrée évincée
+        return data
+
+    def _put(self, key: str, data: bytes):
+        self._put_script(keys=[self._lru, self._sizes, self._total],
+                         args=[self.prefix, key, data, time.time(), self.max_bytes])
+
+    def stats(self) -> dict:
+        return {"support": "redis", "entrées": int(self.r.zcard(self._lru)),
+                "octets": int(self.r.get(self._total) or 0), "max_octets": self.max_bytes}
+
+
+def from_env() -> Optional[SharedCache]:
+    """Cache partagé décrit par MATRIX_SHARED_CACHE, ou None (désactivé / support indisponible)."""
+    target = os.environ.get("MATRIX_SHARED_CACHE", "").strip()
+    if not target:
+        return None
+    max_bytes = int(float(os.environ.get("MATRIX_SHARED_CACHE_MAX_MB", "2048")) * 1024 ** 2)
+    try:
+        if target.startswith(("redis://", "rediss://", "unix://")):
+            return RedisCache(target, max_bytes)
+        return FileCache(target[len("file://"):] if target.startswith("file://") else target, max_bytes)
+    except Exception as e:
+        logger.warning("cache partagé désactivé (%s) : %s", target, e)
+        return None
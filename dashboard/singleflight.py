@@ -0,0 +1,53 @@
+# singleflight.py
+# Coalescence des travaux identiques concurrents hors st.cache_data : le premier appel pour une clé
+# exécute la fonction, les suivants attendent son résultat et le partagent.
+# Les fonctions sous st.cache_data n'en ont pas besoin : Streamlit y tient déjà un verrou de calcul
+# par clé, deux sessions qui ratent la même entrée n'exécutent la fonction qu'une fois. Sert donc
+# là où ce verrou ne couvre pas le recouvrement, ex. la synchronisation du snapshot, mois par mois.
+import threading
+from typing import Any, Callable, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """Renvoie (résultat, partagé) ; `partagé` vaut True si le résultat vient d'un autre appel."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+
+# instance unique par processus (le module reste importé entre les exécutions du script)
+flight = SingleFlight()
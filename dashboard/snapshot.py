@@ -0,0 +1,251 @@
+# snapshot.py
+# Copie locale de v_matrix en Parquet, partitionnée par mois/magasin, interrogée avec DuckDB
+# (moteur SQL embarqué). Les sections du dashboard y lancent de petites requêtes analytiques
+# au lieu de garder toute la période dans un DataFrame :
+#   - élagage de partitions : seuls les dossiers month=…/store=… de la période sont lus ;
+#   - projection : seules les colonnes utilisées par la requête sont décodées.
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import date
+from typing import Callable, Iterable, Optional, Sequence
+
+import pandas as pd
+
+from aggregates import GRANULARITIES, MEASURES
+
+SNAPSHOT_DIR = os.environ.get("MATRIX_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshot"))
+SNAPSHOT_TTL = int(os.environ.get("MATRIX_SNAPSHOT_TTL", "300"))  # rafraîchissement des mois récents (s)
+RECENT_MONTHS = 2  # mois encore susceptibles de recevoir des lignes
+
+_lock = threading.Lock()
+_con_lock = threading.Lock()
+_con = None
+
+
+def available() -> bool:
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def connection():
+    global _con
+    if _con is None:
+        with _con_lock:  # thread de préchauffage et exécutions du script au premier appel
+            if _con is None:
+                import duckdb
+                _con = duckdb.connect(database=":memory:")
+    # un curseur par requête : la connexion DuckDB n'est pas partagée entre threads
+    return _con.cursor()
+
+
+def store_key(name: str) -> str:
+    """Nom de dossier sûr pour un magasin (le nom réel reste dans la colonne store_name)."""
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", name or "") or "_"
+
+
+def months_between(dstart: date, dend: date) -> list:
+    return [p.strftime("%Y-%m") for p in pd.period_range(dstart, dend, freq="M")]
+
+
+def _manifest_path(root: str) -> str:
+    return os.path.join(root, "manifest.json")
+
+
+def read_manifest(root: str = SNAPSHOT_DIR) -> dict:
+    try:
+        with open(_manifest_path(root), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(root: str, manifest: dict):
+    tmp = _manifest_path(root) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, _manifest_path(root))
+
+
+def stale_months(dstart: date, dend: date, root: str = SNAPSHOT_DIR, now: Optional[float] = None,
+                 versions: Optional[dict] = None) -> list:
+    """Mois absents ou périmés. Avec `versions` ({mois: jeton}), un mois est périmé dès que son
+    jeton de version a changé ; sans, les mois récents sont rafraîchis après SNAPSHOT_TTL."""
+    manifest = read_manifest(root)
+    if versions is not None:
+        return [m for m in months_between(dstart, dend)
+                if m not in manifest or manifest[m].get("version") != versions.get(m)]
+    now = now or time.time()
+    recent = set(months_between(date.today().replace(day=1) - pd.DateOffset(months=RECENT_MONTHS - 1), date.today()))
+    out = []
+    for m in months_between(dstart, dend):
+        entry = manifest.get(m)
+        if entry is None or (m in recent and now - entry["synced_at"] > SNAPSHOT_TTL):
+            out.append(m)
+    return out
+
+
+def sync_month(month: str, chunks: Iterable[pd.DataFrame], root: str = SNAPSHOT_DIR,
+               version: Optional[str] = None) -> int:
+    """(Re)écrit le mois `month` à partir de morceaux de lignes v_matrix ; remplacement atomique."""
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = os.path.join(root, f".tmp_month={month}_{os.getpid()}_{threading.get_ident()}")
+    final_dir = os.path.join(root, f"month={month}")
+    con = connection()
+    n = 0
+    try:
+        first = True
+        for chunk in chunks:
+            chunk = chunk.assign(store=chunk["store_name"].map(store_key))
+            con.register("_chunk", chunk)
+            if first:
+                con.execute("create or replace temp table _month as select * from _chunk")
+                first = False
+            else:
+                con.execute("insert into _month select * from _chunk")
+            con.unregister("_chunk")
+            n += len(chunk)
+        if n:
+            con.execute(f"copy (select * from _month order by store_name, period_date, code_article) "
+                        f"to '{tmp_dir}' (format parquet, partition_by (store), overwrite_or_ignore true)")
+        else:
+            os.makedirs(tmp_dir, exist_ok=True)
+        with _lock:
+            old_dir = final_dir + f".old_{os.getpid()}"
+            if os.path.isdir(final_dir):
+                os.replace(final_dir, old_dir)
+            os.replace(tmp_dir, final_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            manifest = read_manifest(root)
+            manifest[month] = {"synced_at": time.time(), "rows": n, "version": version}
+            _write_manifest(root, manifest)
+    finally:
+        con.execute("drop table if exists _month")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return n
+
+
+def sync_range(dstart: date, dend: date, fetch_month: Callable[[date, date], Iterable[pd.DataFrame]],
+               root: str = SNAPSHOT_DIR, months: Optional[Sequence[str]] = None,
+               versions: Optional[dict] = None) -> list:
+    """Synchronise les mois périmés/absents de la période. `fetch_month(début, fin)` produit des morceaux."""
+    todo = list(months) if months is not None else stale_months(dstart, dend, root, versions=versions)
+    for m in todo:
+        p = pd.Period(m, freq="M")
+        sync_month(m, fetch_month(p.start_time.date(), p.end_time.date()), root,
+                   version=(versions or {}).get(m))
+    return todo
+
+
+class DuckAggregates:
+    """Même interface que FrameAggregates / RpcAggregates, sur le snapshot Parquet local."""
+
+    def __init__(self, dstart: date, dend: date, root: str = SNAPSHOT_DIR):
+        self.dstart = dstart
+        self.dend = dend
+        self.root = root
+        self.months = months_between(dstart, dend)
+
+    def _source(self, stores: Optional[Sequence[str]]) -> tuple:
+        # chemins explicites par mois (élagage), puis filtre sur la partition `store`
+        paths = [os.path.join(self.root, f"month={m}", "**", "*.parquet") for m in self.months
+                 if os.path.isdir(os.path.join(self.root, f"month={m}"))]
+        if not paths:
+            return None, None
+        where = ["period_date between ? and ?"]
+        params: list = [pd.Timestamp(self.dstart), pd.Timestamp(self.dend)]
+        if stores:
+            where.append(f"store in ({', '.join('?' * len(stores))})")
+            params += [store_key(s) for s in stores]
+            where.append(f"store_name in ({', '.join('?' * len(stores))})")
+            params += list(stores)
+        src = "read_parquet([" + ", ".join(f"'{p}'" for p in paths) + "], hive_partitioning = true)"
+        return f"{src} where {' and '.join(where)}", params
+
+    def _query(self, select: str, stores: Optional[Sequence[str]], tail: str = "", columns: Sequence[str] = ()) -> pd.DataFrame:
+        src, params = self._source(stores)
+        if src is None:
+            return pd.DataFrame(columns=list(columns))
+        return connection().execute(f"select {select} from {src} {tail}", params).df()
+
+    def kpis(self, stores: Optional[Sequence[str]] = None) -> dict:
+        d = self._query(", ".join(f"coalesce(sum({c}), 0) as {c}" for c in MEASURES) + ", count(*) as n_lignes",
+                        stores, columns=MEASURES + ["n_lignes"])
+        out = {c: float(d[c].iloc[0]) if not d.empty else 0.0 for c in MEASURES}
+        out["n_lignes"] = int(d["n_lignes"].iloc[0]) if not d.empty else 0
+        return out
+
+    def series(self, granularity: str, stores: Optional[Sequence[str]] = None, by_store: bool = True) -> pd.DataFrame:
+        trunc = f"date_trunc('{GRANULARITIES[granularity]}', period_date)::timestamp"
+        keys = ["store_name", "bucket"] if by_store else ["bucket"]
+        sel = (["store_name"] if by_store else []) + [f"{trunc} as bucket"]
+        return self._query(
+            ", ".join(sel) + ", sum(ventes_ttc) as ca_ttc, sum(ventes_ht) as ca_ht, "
+                             "sum(marge_ht) as marge, sum(qte) as qte",
+            stores, f"group by {', '.join(keys)} order by {', '.join(keys)}",
+            columns=keys + ["ca_ttc", "ca_ht", "marge", "qte"])
+
+    def familles(self, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return self._query("famille_finale, sum(ventes_ttc) as ca_ttc", stores,
+                           "group by famille_finale order by ca_ttc desc", columns=["famille_finale", "ca_ttc"])
+
+    def top_articles(self, limit: int, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        return self._query("code_article, libelle_final, sum(qte) as qte, sum(ventes_ttc) as ca_ttc", stores,
+                           f"group by code_article, libelle_final order by ca_ttc desc limit {int(limit)}",
+                           columns=["code_article", "libelle_final", "qte", "ca_ttc"])
+
+    def daily(self, stores: Optional[Sequence[str]] = None, by_store: bool = False) -> pd.DataFrame:
+        keys = "store_name, period_date" if by_store else "period_date"
+        d = self._query(f"{keys}, " + ", ".join(f"sum({c}) as {c}" for c in MEASURES), stores,
+                        f"group by {keys} order by {keys}",
+                        columns=(["store_name"] if by_store else []) + ["period_date"] + MEASURES)
+        if not by_store:
+            d.insert(0, "store_name", "")
+        return d
+
+    def store_weeks(self, stores: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        d = self._query("store_name, isoyear(period_date) as iso_year, week(period_date) as iso_week, "
+                        + ", ".join(f"sum({c}) as {c}" for c in MEASURES),
+                        stores, "group by 1, 2, 3 order by 1, 2, 3",
+                        columns=["store_name", "iso_year", "iso_week"] + MEASURES)
+        for c in ["iso_year", "iso_week"]:
+            d[c] = d[c].astype(int)
+        return d
+
+    def dow_week(self, stores: Optional[Sequence[str]] = None, by_store: bool = False) -> pd.DataFrame:
+        keys = (["store_name"] if by_store else []) + ["iso_year", "iso_week", "isodow"]
+        groups = ", ".join(str(i + 1) for i in range(len(keys)))
+        d = self._query(("store_name, " if by_store else "")
+                        + "isoyear(period_date) as iso_year, week(period_date) as iso_week, "
+                        "isodow(period_date) as isodow, sum(qte) as qte, sum(ventes_ttc) as ventes_ttc",
+                        stores, f"group by {groups} order by {groups}",
+                        columns=keys + ["qte", "ventes_ttc"])
+        for c in ["iso_year", "iso_week", "isodow"]:
+            d[c] = d[c].astype(int)
+        return d
+
+    def detail_page(self, sort_col: str, ascending: bool, search: str, limit: int, offset: int,
+                    columns: Sequence[str], tiebreak: Sequence[str] = ()) -> tuple:
+        """(nb lignes filtrées, page) : tri/filtre/fenêtre exécutés par DuckDB."""
+        src, params = self._source(None)
+        if src is None:
+            return 0, pd.DataFrame(columns=list(columns))
+        if search:
+            # recherche littérale, comme le mode pandas : % et _ saisis ne sont pas des jokers
+            literal = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            src += " and (" + " or ".join(f"{c} ilike ? escape '\\'"
+                                          for c in ["store_name", "code_article", "libelle_final", "famille_finale"]) + ")"
+            params = params + [f"%{literal}%"] * 4
+        by = [sort_col] + [c for c in tiebreak if c != sort_col]
+        order = ", ".join(f"{c} {'asc' if (ascending or i) else 'desc'}" for i, c in enumerate(by))
+        con = connection()
+        total = con.execute(f"select count(*) from {src}", params).fetchone()[0]
+        page = con.execute(f"select {', '.join(columns)} from {src} order by {order} limit {int(limit)} offset {int(offset)}",
+                           params).df()
+        return int(total), page
@@ -0,0 +1,69 @@
+# warmup.py
+# Préchauffage des caches en arrière-plan : un thread par processus précharge et pré-agrège
+# les périodes les plus consultées, puis les rafraîchit dès que leur version de données change
+# (ou au plus tard toutes les REFRESH_S secondes). Les utilisateurs tombent sur un cache chaud.
+import logging
+import threading
+import time
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger("matrix.warmup")
+
+# une tâche = (nom de la période, jeton de version, fonction de préchauffage)
+Task = Tuple[str, str, Callable[[], None]]
+
+
+class WarmupWorker(threading.Thread):
+    def __init__(self, tasks: Callable[[], List[Task]], poll_s: float = 30, refresh_s: float = 3600):
+        super().__init__(name="matrix-warmup", daemon=True)
+        self.tasks = tasks
+        self.poll_s = poll_s
+        self.refresh_s = refresh_s
+        self.status = {}  # nom -> {"etat", "version", "le", "secondes", "erreur"}
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self.status.items()}
+
+    def is_warm(self) -> bool:
+        status = self.snapshot()
+        return bool(status) and all(v["etat"] == "chaud" for v in status.values())
+
+    def _set(self, name: str, **kw):
+        with self._lock:
+            self.status.setdefault(name, {"etat": "froid", "version": None, "le": None, "secondes": None, "erreur": None})
+            self.status[name].update(kw)
+
+    def run_once(self):
+        try:
+            tasks = self.tasks()
+        except Exception as e:
+            logger.warning("warm-up : liste des tâches indisponible (%s)", e)
+            return
+        now = time.time()
+        for name, version, fn in tasks:
+            cur = self.snapshot().get(name)
+            fresh = (cur is not None and cur["etat"] == "chaud" and cur["version"] == version
+                     and now - (cur["le"] or 0) < self.refresh_s)
+            if fresh:
+                continue
+            self._set(name, etat="en cours")
+            t = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                logger.warning("warm-up %s : %s", name, e)
+                self._set(name, etat="erreur", erreur=str(e))
+                continue
+            self._set(name, etat="chaud", version=version, le=time.time(),
+                      secondes=round(time.perf_counter() - t, 2), erreur=None)
+
+    def run(self):
+        while not self._halt.is_set():
+            self.run_once()
+            self._halt.wait(self.poll_s)
+
+    def stop(self):
+        self._halt.set()
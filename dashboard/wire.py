@@ -0,0 +1,82 @@
+# wire.py
+# Décodage des pages v_matrix reçues de PostgREST.
+#   - JSON : liste de dicts par ligne -> DataFrame -> conversions colonne par colonne
+#   - CSV  : pages texte (Accept: text/csv) décodées en une passe en colonnes typées,
+#            sans objet Python par ligne (moteur pyarrow si disponible)
+# et jointure locale de la dimension article : les lignes de faits ne transportent que
+# code_article, libellés et familles sont rattachés ici.
+import io
+import importlib.util
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+NUM_COLS = ["qte", "ventes_ht", "ventes_ttc", "marge_ht", "marge_pct"]
+TEXT_COLS = ["store_name", "code_article", "libelle_final", "famille_finale"]
+MATRIX_COLS = ["store_name", "period_date", "code_article", "libelle_final", "famille_finale"] + NUM_COLS
+ARTICLE_COLS = ["libelle_final", "famille_finale"]
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+
+
+def empty_frame() -> pd.DataFrame:
+    """Aucune ligne : toutes les colonnes de v_matrix, typées (les agrégats pandas valent zéro)."""
+    return pd.DataFrame({c: pd.Series(dtype="datetime64[ns]" if c == "period_date" else
+                                      "float64" if c in NUM_COLS else object) for c in MATRIX_COLS})
+
+
+def typed_frame(rows) -> pd.DataFrame:
+    df = pd.DataFrame(rows or [])
+    if df.empty:
+        return empty_frame()
+    df["period_date"] = pd.to_datetime(df["period_date"])
+    for c in NUM_COLS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+    return df
+
+
+def csv_has_rows(text: str) -> bool:
+    # une page vide ne contient que l'en-tête (ou rien)
+    nl = text.find("\n")
+    return nl != -1 and nl < len(text.rstrip("\n"))
+
+
+def decode_csv_pages(pages: List[str]) -> pd.DataFrame:
+    """Concatène des pages CSV (en-tête répété sur chaque page) et les décode en une fois."""
+    pages = [p for p in pages if p]
+    if not pages:
+        return empty_frame()
+    header, _, first_body = pages[0].partition("\n")
+    bodies = [first_body] + [p.partition("\n")[2] for p in pages[1:]]
+    buf = io.BytesIO((header + "\n" + "".join(b if b.endswith("\n") else b + "\n" for b in bodies if b)).encode("utf-8"))
+
+    columns = header.split(",")
+    # mêmes types que typed_frame : texte au type chaîne par défaut de pandas, mesures en float64,
+    # qte en int64 si toutes les valeurs sont entières (comme pd.to_numeric sur les pages JSON)
+    dtype = {c: "float64" for c in NUM_COLS if c in columns}
+    dtype.update({c: str for c in TEXT_COLS if c in columns})
+    df = pd.read_csv(buf, engine=CSV_ENGINE, dtype=dtype, keep_default_na=False,
+                     na_values=[""], parse_dates=["period_date"] if "period_date" in columns else False)
+    if "qte" in df.columns and df["qte"].notna().all() and (df["qte"] % 1 == 0).all():
+        df["qte"] = df["qte"].astype("int64")
+    return df
+
+
+def article_frame(rows) -> pd.DataFrame:
+    """Dimension article indexée par code_article (une ligne par code)."""
+    dim = pd.DataFrame(rows or [], columns=["code_article"] + ARTICLE_COLS)
+    return dim.drop_duplicates("code_article").set_index("code_article")
+
+
+def join_articles(df: pd.DataFrame, dim: pd.DataFrame, categorical: bool = True) -> pd.DataFrame:
+    """Ajoute libelle_final / famille_finale après code_article. En catégories, chaque libellé
+    n'est stocké qu'une fois ; sinon en chaînes (morceaux exportés ou écrits dans le snapshot)."""
+    codes = pd.Categorical(df["code_article"])
+    pos = codes.codes
+    loc = df.columns.get_loc("code_article") + 1
+    for i, col in enumerate(ARTICLE_COLS):
+        labels = pd.Categorical(dim[col].reindex(codes.categories).to_numpy())
+        values = pd.Categorical.from_codes(np.where(pos >= 0, labels.codes[pos], -1), dtype=labels.dtype)
+        df.insert(loc + i, col, values if categorical else pd.Series(values).astype("string").to_numpy())
+    return df
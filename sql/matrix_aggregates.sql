@@ -0,0 +1,161 @@
+-- matrix_aggregates.sql
+-- Agrégats du dashboard calculés côté base (appelés via supabase.rpc).
+-- Tous prennent la période [p_start, p_end] et un filtre magasins optionnel (NULL = tous).
+-- À exécuter dans l'éditeur SQL Supabase ; les fonctions respectent la RLS de v_matrix (security invoker).
+-- Les casts explicites alignent les types renvoyés sur la signature, quel que soit le type des colonnes.
+-- Les fonctions dont le résultat peut dépasser max-rows PostgREST (1000 lignes : séries par magasin,
+-- matrices par semaine…) renvoient un tableau JSON unique : une exécution, une réponse, pas de troncature.
+
+create or replace function public.matrix_kpis(
+    p_start date, p_end date, p_stores text[] default null
+)
+returns table (qte numeric, ventes_ht numeric, ventes_ttc numeric, marge_ht numeric, n_lignes bigint)
+language sql stable security invoker as $$
+    select coalesce(sum(m.qte), 0)::numeric, coalesce(sum(m.ventes_ht), 0)::numeric,
+           coalesce(sum(m.ventes_ttc), 0)::numeric, coalesce(sum(m.marge_ht), 0)::numeric, count(*)
+    from public.v_matrix m
+    where m.period_date between p_start and p_end
+      and (p_stores is null or m.store_name = any (p_stores));
+$$;
+
+-- p_granularity : 'day' | 'week' (semaine ISO, début lundi) | 'month'
+-- [{store_name, bucket, ca_ttc, ca_ht, marge, qte}, ...]
+drop function if exists public.matrix_series(date, date, text, text[], boolean);
+create or replace function public.matrix_series(
+    p_start date, p_end date, p_granularity text default 'day',
+    p_stores text[] default null, p_by_store boolean default true
+)
+returns json
+language sql stable security invoker as $$
+    select coalesce(json_agg(s order by s.store_name, s.bucket), '[]'::json)
+    from (
+        select case when p_by_store then m.store_name::text end as store_name,
+               date_trunc(p_granularity, m.period_date)::date as bucket,
+               sum(m.ventes_ttc)::numeric as ca_ttc, sum(m.ventes_ht)::numeric as ca_ht,
+               sum(m.marge_ht)::numeric as marge, sum(m.qte)::numeric as qte
+        from public.v_matrix m
+        where m.period_date between p_start and p_end
+          and (p_stores is null or m.store_name = any (p_stores))
+        group by 1, 2
+    ) s;
+$$;
+
+create or replace function public.matrix_familles(
+    p_start date, p_end date, p_stores text[] default null
+)
+returns table (famille_finale text, ca_ttc numeric)
+language sql stable security invoker as $$
+    select m.famille_finale::text, sum(m.ventes_ttc)::numeric
+    from public.v_matrix m
+    where m.period_date between p_start and p_end
+      and (p_stores is null or m.store_name = any (p_stores))
+    group by 1
+    order by 2 desc;
+$$;
+
+create or replace function public.matrix_top_articles(
+    p_start date, p_end date, p_stores text[] default null, p_limit integer default 15
+)
+returns table (code_article text, libelle_final text, qte numeric, ca_ttc numeric)
+language sql stable security invoker as $$
+    select m.code_article::text, m.libelle_final::text, sum(m.qte)::numeric, sum(m.ventes_ttc)::numeric
+    from public.v_matrix m
+    where m.period_date between p_start and p_end
+      and (p_stores is null or m.store_name = any (p_stores))
+    group by 1, 2
+    order by 4 desc
+    limit p_limit;
+$$;
+
+-- Matrice jour de semaine (isodow 1 = lundi) × semaine ISO, par magasin si p_by_store
+-- (index des moyennes glissantes par magasin)
+-- [{store_name, iso_year, iso_week, isodow, qte, ventes_ttc}, ...]
+drop function if exists public.matrix_dow_week(date, date, text[]);
+drop function if exists public.matrix_dow_week(date, date, text[], boolean);
+create or replace function public.matrix_dow_week(
+    p_start date, p_end date, p_stores text[] default null, p_by_store boolean default false
+)
+returns json
+language sql stable security invoker as $$
+    select coalesce(json_agg(d order by d.store_name, d.iso_year, d.iso_week, d.isodow), '[]'::json)
+    from (
+        select case when p_by_store then m.store_name::text end as store_name,
+               extract(isoyear from m.period_date)::int as iso_year,
+               extract(week from m.period_date)::int as iso_week,
+               extract(isodow from m.period_date)::int as isodow,
+               sum(m.qte)::numeric as qte, sum(m.ventes_ttc)::numeric as ventes_ttc
+        from public.v_matrix m
+        where m.period_date between p_start and p_end
+          and (p_stores is null or m.store_name = any (p_stores))
+        group by 1, 2, 3, 4
+    ) d;
+$$;
+
+-- Totaux par jour (et par magasin si p_by_store) : base de la comparaison N-1
+-- [{store_name, period_date, qte, ventes_ht, ventes_ttc, marge_ht}, ...]
+drop function if exists public.matrix_daily(date, date, text[], boolean);
+create or replace function public.matrix_daily(
+    p_start date, p_end date, p_stores text[] default null, p_by_store boolean default false
+)
+returns json
+language sql stable security invoker as $$
+    select coalesce(json_agg(d order by d.store_name, d.period_date), '[]'::json)
+    from (
+        select case when p_by_store then m.store_name::text end as store_name, m.period_date,
+               sum(m.qte)::numeric as qte, sum(m.ventes_ht)::numeric as ventes_ht,
+               sum(m.ventes_ttc)::numeric as ventes_ttc, sum(m.marge_ht)::numeric as marge_ht
+        from public.v_matrix m
+        where m.period_date between p_start and p_end
+          and (p_stores is null or m.store_name = any (p_stores))
+        group by 1, 2
+    ) d;
+$$;
+
+-- Totaux magasin × semaine ISO : classement réseau (quelques centaines de magasins × 53 semaines au plus,
+-- donc plusieurs milliers de lignes : une seule agrégation, renvoyée en un tableau JSON trié)
+-- [{store_name, iso_year, iso_week, qte, ventes_ht, ventes_ttc, marge_ht}, ...]
+drop function if exists public.matrix_store_weeks(date, date, text[]);
+create or replace function public.matrix_store_weeks(
+    p_start date, p_end date, p_stores text[] default null
+)
+returns json
+language sql stable security invoker as $$
+    select coalesce(json_agg(w order by w.store_name, w.iso_year, w.iso_week), '[]'::json)
+    from (
+        select m.store_name::text as store_name,
+               extract(isoyear from m.period_date)::int as iso_year,
+               extract(week from m.period_date)::int as iso_week,
+               sum(m.qte)::numeric as qte, sum(m.ventes_ht)::numeric as ventes_ht,
+               sum(m.ventes_ttc)::numeric as ventes_ttc, sum(m.marge_ht)::numeric as marge_ht
+        from public.v_matrix m
+        where m.period_date between p_start and p_end
+          and (p_stores is null or m.store_name = any (p_stores))
+        group by 1, 2, 3
+    ) w;
+$$;
+
+-- Dimension article (code -> libellé, famille) : chargée une fois par version des données ;
+-- les lignes de faits ne transportent plus que code_article et les mesures.
+-- Un seul parcours de v_matrix, renvoyé en un tableau JSON trié (pas de pagination qui relancerait
+-- le DISTINCT ON à chaque page) : [{code_article, libelle_final, famille_finale}, ...]
+drop function if exists public.matrix_articles();
+create or replace function public.matrix_articles()
+returns json
+language sql stable security invoker as $$
+    select coalesce(json_agg(a order by a.code_article), '[]'::json)
+    from (
+        select distinct on (m.code_article) m.code_article::text as code_article,
+               m.libelle_final::text as libelle_final, m.famille_finale::text as famille_finale
+        from public.v_matrix m
+        order by m.code_article, m.period_date desc
+    ) a;
+$$;
+
+grant execute on function public.matrix_kpis(date, date, text[]) to authenticated;
+grant execute on function public.matrix_series(date, date, text, text[], boolean) to authenticated;
+grant execute on function public.matrix_familles(date, date, text[]) to authenticated;
+grant execute on function public.matrix_top_articles(date, date, text[], integer) to authenticated;
+grant execute on function public.matrix_dow_week(date, date, text[], boolean) to authenticated;
+grant execute on function public.matrix_daily(date, date, text[], boolean) to authenticated;
+grant execute on function public.matrix_store_weeks(date, date, text[]) to authenticated;
+grant execute on function public.matrix_articles() to authenticated;
@@ -0,0 +1,59 @@
+-- matrix_versions.sql
+-- Signal de version des données par partition (magasin × mois), incrémenté par l'uploader
+-- après chaque import. Le dashboard indexe ses caches sur ces versions : l'historique inchangé
+-- reste en cache indéfiniment et un jour fraîchement importé est visible immédiatement.
+-- row_count (lignes v_matrix de la partition) alimente le planificateur de chargement.
+
+create table if not exists public.matrix_partitions (
+    store_name text not null,
+    month date not null,                 -- 1er jour du mois
+    version bigint not null default 1,
+    updated_at timestamptz not null default now(),
+    primary key (store_name, month)
+);
+
+create index if not exists matrix_partitions_updated_at_idx on public.matrix_partitions (updated_at desc);
+
+alter table public.matrix_partitions add column if not exists row_count bigint;
+
+-- amorçage : chaque magasin × mois déjà présent dans v_matrix reçoit sa partition (version 1) et
+-- son nombre de lignes ; sans cela, un mois importé avant la table n'a ni version ni estimation
+-- tant qu'il n'est pas réimporté. Rejouable : les comptes existants sont recalculés, les versions
+-- ne bougent pas.
+insert into public.matrix_partitions as mp (store_name, month, row_count)
+select m.store_name, date_trunc('month', m.period_date)::date, count(*)
+from public.v_matrix m
+where m.store_name is not null and m.period_date is not null
+group by 1, 2
+on conflict (store_name, month) do update set row_count = excluded.row_count;
+
+-- p_partitions : [{"store_name": "ANGLET0047", "month": "2025-07-01"}, ...]
+create or replace function public.bump_matrix_partitions(p_partitions jsonb)
+returns void
+language sql volatile security definer set search_path = public as $$
+    insert into public.matrix_partitions as mp (store_name, month)
+    select distinct p ->> 'store_name', date_trunc('month', (p ->> 'month')::date)::date
+    from jsonb_array_elements(p_partitions) p
+    on conflict (store_name, month)
+    do update set version = mp.version + 1, updated_at = now();
+
+    -- compte recalculé (et non additionné) : un ré-import en upsert ne double pas les lignes
+    update public.matrix_partitions mp
+    set row_count = (
+        select count(*) from public.v_matrix m
+        where m.store_name = mp.store_name
+          and m.period_date >= mp.month and m.period_date < (mp.month + interval '1 month')
+    )
+    from (
+        select distinct p ->> 'store_name' as store_name, date_trunc('month', (p ->> 'month')::date)::date as month
+        from jsonb_array_elements(p_partitions) p
+    ) t
+    where mp.store_name = t.store_name and mp.month = t.month;
+$$;
+
+alter table public.matrix_partitions enable row level security;
+drop policy if exists "lecture partitions" on public.matrix_partitions;
+create policy "lecture partitions" on public.matrix_partitions for select to authenticated using (true);
+grant select on public.matrix_partitions to authenticated;
+revoke execute on function public.bump_matrix_partitions(jsonb) from public, anon, authenticated;
+grant execute on function public.bump_matrix_partitions(jsonb) to service_role;
@@ -1,6 +1,8 @@
 import os
 import csv
 import glob
+import json
+import hashlib
 from datetime import datetime
 from typing import List, Dict, Any
 
@@ -14,6 +16,7 @@ from supabase import create_client, Client
 # TABLE_NAME=matrix_lignes
 # DO_UPSERT=true
 # BATCH_SIZE=500
+# LEDGER_DIR=.upload_ledger
 # ------------------------------------------
 
 load_dotenv()
@@ -23,6 +26,7 @@ CSV_GLOB = os.environ.get("CSV_GLOB", "matrix_*.csv")
 TABLE_NAME = os.environ.get("TABLE_NAME", "matrix_lignes")
 DO_UPSERT = os.environ.get("DO_UPSERT", "true").lower() == "true"
 BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "500"))
+LEDGER_DIR = os.environ.get("LEDGER_DIR", ".upload_ledger")
 
 if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE:
     raise RuntimeError("Veuillez définir SUPABASE_URL et SUPABASE_SERVICE_ROLE dans le fichier .env.")
@@ -138,18 +142,91 @@ def read_csv_dicts_with_fallback(path: str):
             continue
     raise RuntimeError(f"Impossible de lire {path} (dernier essai: {last_error})")
 
+# ---------- Journal des morceaux confirmés (reprise après interruption) ----------
+# Un fichier JSON par CSV source : empreinte du fichier + morceaux acceptés par la base
+# (plage de lignes -> hash du contenu). Une relance reprend au premier morceau non confirmé ;
+# le fichier n'est marqué "complete" qu'une fois tous les morceaux passés et les versions de
+# partitions incrémentées. Journal nommé d'après le chemin résolu du CSV.
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_hash(chunk: List[Dict[str, Any]]) -> str:
+    return hashlib.sha256(json.dumps(chunk, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def ledger_path(path: str) -> str:
+    # nom lisible + empreinte du chemin résolu : deux CSV homonymes de dossiers différents
+    # ont chacun leur journal
+    digest = hashlib.sha256(os.path.realpath(path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(LEDGER_DIR, f"{os.path.basename(path)}.{digest}.json")
+
+def load_ledger(path: str, file_hash: str) -> Dict[str, Any]:
+    """Journal existant s'il décrit le même contenu, la même table et le même découpage ; sinon vierge."""
+    try:
+        with open(ledger_path(path), "r", encoding="utf-8") as f:
+            ledger = json.load(f)
+        if (ledger.get("file_hash") == file_hash and ledger.get("table") == TABLE_NAME
+                and ledger.get("batch_size") == BATCH_SIZE):
+            return ledger
+    except (OSError, ValueError):
+        pass
+    return {"file": os.path.realpath(path), "file_hash": file_hash, "table": TABLE_NAME,
+            "batch_size": BATCH_SIZE, "chunks": {}, "complete": False}
+
+def save_ledger(path: str, ledger: Dict[str, Any]):
+    os.makedirs(LEDGER_DIR, exist_ok=True)
+    tmp = ledger_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ledger, f, indent=1)
+    os.replace(tmp, ledger_path(path))  # écriture atomique : jamais de journal à moitié écrit
+
 # ---------- Upload ----------
 
-def upload_rows(rows: List[Dict[str, Any]]):
-    for i in range(0, len(rows), BATCH_SIZE):
-        chunk = rows[i : i + BATCH_SIZE]
+def upload_rows(rows: List[Dict[str, Any]], path: str = None, ledger: Dict[str, Any] = None):
+    """Envoie les lignes par morceaux de BATCH_SIZE ; avec un journal, saute les morceaux déjà confirmés."""
+    chunks = [(i, min(i + BATCH_SIZE, len(rows))) for i in range(0, len(rows), BATCH_SIZE)]
+    confirmed = ledger["chunks"] if ledger is not None else {}
+    todo = [(a, b) for a, b in chunks if confirmed.get(f"{a}-{b}") != chunk_hash(rows[a:b])]
+    if ledger is not None and todo and len(todo) < len(chunks):
+        print(f"[REPRISE] {ledger['file']} : {len(chunks) - len(todo)}/{len(chunks)} morceaux déjà confirmés, "
+              f"reprise à la ligne {todo[0][0] + 1}")
+    for a, b in todo:
+        chunk = rows[a:b]
         if DO_UPSERT:
             supabase.table(TABLE_NAME).upsert(chunk).execute()
         else:
             supabase.table(TABLE_NAME).insert(chunk).execute()
+        if ledger is not None:
+            confirmed[f"{a}-{b}"] = chunk_hash(chunk)
+            save_ledger(path, ledger)
+
+def bump_partitions(rows: List[Dict[str, Any]]):
+    """Incrémente la version des partitions (magasin × mois) touchées : invalide les caches du dashboard.
+    Lève une erreur en cas d'échec : le fichier reste alors incomplet et la relance refait le bump."""
+    partitions = sorted({
+        (r["store_name"], r["period_date"][:7] + "-01")
+        for r in rows if r.get("store_name") and r.get("period_date")
+    })
+    if not partitions:
+        return
+    payload = [{"store_name": s, "month": m} for s, m in partitions]
+    try:
+        supabase.rpc("bump_matrix_partitions", {"p_partitions": payload}).execute()
+    except Exception as e:
+        raise RuntimeError(f"versions de partitions non mises à jour ({len(partitions)}), "
+                           f"lignes envoyées, relancer pour réessayer : {e}") from e
 
 def process_file(path: str):
     try:
+        ledger = load_ledger(path, file_sha256(path))
+        if ledger["complete"]:
+            print(f"[SKIP] Déjà importé (contenu inchangé) : {path}")
+            return
+
         rows_dicts, header, delim = read_csv_dicts_with_fallback(path)
         if not rows_dicts:
             print(f"[INFO] Fichier vide ou en-têtes non reconnues : {path}")
@@ -163,7 +240,10 @@ def process_file(path: str):
         if bad_dates > 0:
             print(f"[WARN] {bad_dates} ligne(s) sans date jj/mm/aaaa) dans {path}")
 
-        upload_rows(rows)
+        upload_rows(rows, path, ledger)
+        bump_partitions(rows)
+        ledger["complete"] = True
+        save_ledger(path, ledger)
         print(f"[OK] Importé : {path} ({len(rows)} lignes)")
     except Exception as e:
         print(f"[ERREUR] {path} : {e}")